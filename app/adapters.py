@@ -1,32 +1,46 @@
 """Responsible for transforming data between interactors and interface"""
 
-from datetime import datetime
-from typing import Any, Generator, Iterable
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from operator import attrgetter
+from typing import Any, Generator, Iterable, Iterator
 
 from pydantic import BaseModel
 
-from .entities import WeatherData
+from .entities import CHANNELS, WeatherBatch, WeatherData
+from .exceptions import DatabaseIntegrityError
+from .exporters import ExportFormat, export
 from .interactors import (
-    AverageWeatherQuery,
-    LatestWeatherQuery,
+    ExportWeatherQuery,
+    PercentileWeatherQuery,
+    RetentionPolicy,
     TimeSeriesWeatherQuery,
     WeatherInteractor,
+    WeatherQuery,
 )
+from .profiling import phase
+from .resampling import aligned_grid, fill_grid, minmax
+
+DEFAULT_STATION = "default"
 
 
 class RawWeatherData(BaseModel):
     ts: datetime | str
     rows: list[tuple[str, Any]]
+    name: str = DEFAULT_STATION
 
     def transform(self) -> WeatherData:
+        return WeatherData(**self.to_row())
+
+    def to_row(self) -> dict[str, Any]:
+        """Flat, unvalidated mapping; e.g. for `WeatherBatch.from_rows`"""
         # Format timestamp
         if isinstance(self.ts, str):
             ts = datetime.fromisoformat(self.ts)
         else:
             ts = self.ts
         # Map rows to dict
-        kwargs = {**{"timestamp": ts}, **dict(self.rows)}
-        return WeatherData(**kwargs)
+        return {**{"station_id": self.name, "timestamp": ts}, **dict(self.rows)}
 
 
 class CliWeatherAdapter:
@@ -34,13 +48,74 @@ class CliWeatherAdapter:
         self._interactor = interactor
 
     def load(self, paths: Iterable[str]):
-        self._interactor.load(self._open_files(paths))
+        self._interactor.load(WeatherBatch.from_rows(self._open_files(paths)))
+
+    def load_batch(self, paths: list[str]) -> int:
+        """Loads a batch of files in one transaction; if that fails, loads them
+        one by one, skipping (and reporting) files that can't be loaded, so a
+        single bad file doesn't hold up the rest. Returns the number loaded."""
+        try:
+            self.load(paths)
+            return len(paths)
+        except (DatabaseIntegrityError, OSError, ValueError):
+            # ValueError covers malformed files (incl. pydantic's ValidationError),
+            # OSError files that were removed or can't be read
+            pass
+        loaded = 0
+        for path in paths:
+            try:
+                self.load([path])
+                loaded += 1
+            except DatabaseIntegrityError:
+                print(f"Skipping {path}: already loaded")
+            except (OSError, ValueError) as err:
+                print(f"Skipping {path}: {err}")
+        return loaded
+
+    def rebuild_sketches(self):
+        count = self._interactor.rebuild_sketches()
+        print(f"Sketched {count} rows")
+
+    def rename_station(self, old: str, new: str):
+        moved = self._interactor.rename_station(old, new)
+        print(f"Moved {moved} rows from station {old} to {new}")
+
+    def delete_station(self, station_id: str) -> int:
+        deleted = self._interactor.delete_station(station_id)
+        print(f"Deleted {deleted} rows of station {station_id}")
+        return deleted
+
+    def compact(self, max_age_days: int, interval_seconds: int, batch_seconds: int):
+        policy = RetentionPolicy(
+            max_age=timedelta(days=max_age_days),
+            interval=timedelta(seconds=interval_seconds),
+            batch=timedelta(seconds=batch_seconds),
+        )
+        try:
+            removed = self._interactor.apply_retention(policy)
+        except ValueError as err:
+            print(f"Can't compact: {err}")
+            return
+        print(f"Compacted {removed} rows")
+
+    def export(
+        self,
+        after: datetime,
+        before: datetime,
+        station_id: str | None,
+        fmt: ExportFormat,
+        path: str,
+    ):
+        query = ExportWeatherQuery(after=after, before=before, station_id=station_id)
+        with open(path, "wb") as f:
+            for data in export(self._interactor.export(query), fmt):
+                f.write(data)
 
     @classmethod
-    def _open_files(cls, paths: Iterable[str]) -> Generator[WeatherData, None, None]:
+    def _open_files(cls, paths: Iterable[str]) -> Generator[dict, None, None]:
         for path in paths:
             data = RawWeatherData.parse_file(path)
-            yield data.transform()
+            yield data.to_row()
 
 
 class WebAppWeatherAdapter:
@@ -48,22 +123,112 @@ class WebAppWeatherAdapter:
         self._interactor = interactor
 
     def load(self, data: Iterable[RawWeatherData]):
-        parsed_data = map(lambda x: x.transform(), data)
-        self._interactor.load(parsed_data)
+        self._interactor.load(WeatherBatch.from_rows(x.to_row() for x in data))
 
-    def get(
-        self, query: LatestWeatherQuery | AverageWeatherQuery | TimeSeriesWeatherQuery
-    ) -> dict:
+    def get(self, query: WeatherQuery) -> dict:
+        if query.kind == "timeseries" and query.max_points is not None:
+            return self._downsample(query)
         result = self._interactor.get(query)
-        if query.kind == "timeseries":
-            return self._pivot_timeseries(result)
-        else:
-            return result[0].dict()
+        with phase("pivot"):
+            if query.kind == "timeseries":
+                pivoted = self._pivot_timeseries(result)
+                if query.fill is not None:
+                    return self._fill(pivoted, query)
+                return pivoted
+            elif query.kind == "rolling":
+                return self._pivot_timeseries(result)
+            else:
+                return result[0].dict()
+
+    def get_percentiles(self, query: PercentileWeatherQuery) -> dict:
+        """Per period a timestamp and sample count, and per channel a column
+        for each percentile"""
+        result = self._interactor.get_percentiles(query)
+        with phase("pivot"):
+            timestamps = list(dict.fromkeys(entry.timestamp for entry in result))
+            index = {ts: i for i, ts in enumerate(timestamps)}
+            labels = [f"{p:g}" for p in query.percentiles]
+            out: dict[str, Any] = {
+                "timestamp": timestamps,
+                "count": [0] * len(timestamps),
+            }
+            for channel in query.channels:
+                out[channel] = {label: [None] * len(timestamps) for label in labels}
+            for entry in result:
+                i = index[entry.timestamp]
+                out["count"][i] = max(out["count"][i], entry.count)
+                for label, value in zip(labels, entry.values, strict=True):
+                    out[entry.channel][label][i] = value
+            return out
+
+    def export(self, query: ExportWeatherQuery, fmt: ExportFormat) -> Iterator[bytes]:
+        return export(self._interactor.export(query), fmt)
+
+    def stream(
+        self, query: TimeSeriesWeatherQuery, chunk_size: int = 1000
+    ) -> Iterator[dict[str, list]]:
+        """Yields the timeseries in pivoted chunks of at most `chunk_size`
+        buckets"""
+        rows = self._interactor.stream(query, chunk_size=chunk_size)
+        while chunk := list(islice(rows, chunk_size)):
+            with phase("pivot"):
+                pivoted = self._pivot_timeseries(chunk)
+            yield pivoted
 
     def _pivot_timeseries(self, data: list[WeatherData]) -> dict[str, list]:
-        out: dict[str, list] = {key: [] for key in WeatherData.__fields__}
-        for entry in data:
-            d = entry.dict()
-            for key in WeatherData.__fields__:
-                out[key].append(d[key])
+        # Reads attributes directly, rather than building a dict per entry
+        keys = list(WeatherData.__fields__)
+        if not data:
+            return {key: [] for key in keys}
+        columns = zip(*map(attrgetter(*keys), data), strict=True)
+        return {key: list(column) for key, column in zip(keys, columns, strict=True)}
+
+    def _downsample(self, query: TimeSeriesWeatherQuery) -> dict[str, dict[str, list]]:
+        """Downsamples each field separately to its minimum and maximum per
+        bucket, so every field gets its own timestamps; the timeseries is
+        streamed in chunks, so memory is bounded by `max_points`, not the range"""
+        assert query.max_points is not None
+        tz = timezone(query.tz_offset)
+        values = attrgetter(*CHANNELS)
+        rows = self._interactor.stream(query)
+        with phase("pivot"):
+            points = minmax(
+                ((entry.timestamp.timestamp(), values(entry)) for entry in rows),
+                query.after.timestamp(),
+                query.before.timestamp(),
+                query.max_points // 2,
+            )
+            return {
+                key: {
+                    "timestamp": [datetime.fromtimestamp(x, tz=tz) for x, _ in column],
+                    "value": [y for _, y in column],
+                }
+                for key, column in zip(
+                    CHANNELS, points or [[] for _ in CHANNELS], strict=True
+                )
+            }
+
+    def _fill(self, data: dict[str, list], query: TimeSeriesWeatherQuery) -> dict:
+        """Reindexes data onto a fixed grid from `after` to `before`, aligned to
+        the local time of `tz_offset`"""
+        assert query.fill is not None
+        tz = timezone(query.tz_offset)
+        step = int(query.interval.total_seconds())
+        grid = aligned_grid(
+            int(query.after.timestamp()),
+            int(query.before.timestamp()),
+            step,
+            int(query.tz_offset.total_seconds()),
+        )
+        xs = [int(ts.timestamp()) for ts in data["timestamp"]]
+        columns = {
+            key: values
+            for key, values in data.items()
+            if key not in ("station_id", "timestamp")
+        }
+        out: dict[str, list] = {
+            "station_id": [query.station_id] * len(grid),
+            "timestamp": [datetime.fromtimestamp(x, tz=tz) for x in grid],
+        }
+        out.update(fill_grid(xs, columns, grid, query.fill))
         return out
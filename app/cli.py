@@ -1,8 +1,11 @@
-"""Simple CLI for accessing weather data; for now simply for bulk creating
-data entries, e.g. for creating dev database"""
+"""Simple CLI for accessing weather data; for bulk creating data entries (e.g. for
+creating dev database), applying the retention policy and exporting data"""
 
 import argparse
 import os
+import sqlite3
+import time
+from datetime import datetime
 from typing import Generator
 
 from app.adapters import (
@@ -13,10 +16,13 @@ from app.gateways import SQLWeatherDbGateway
 from app.interactors import (
     WeatherInteractor,
 )
+from app.migrations import SQLMigrator
+from app.watchers import DirectoryWatcher
 
 
 def get_interactor(db_url: str) -> CliWeatherAdapter:
     conn = SQLiteConnection(db_url)
+    SQLMigrator(conn).migrate()
     gateway = SQLWeatherDbGateway(conn)
     interactor = WeatherInteractor(gateway)
     return CliWeatherAdapter(interactor)
@@ -30,19 +36,168 @@ def file_path_generator(path: str) -> Generator[str, None, None]:
             yield path
 
 
+def watch(
+    adapter: CliWeatherAdapter,
+    watcher: DirectoryWatcher,
+    max_latency: float,
+    max_batch: int,
+) -> None:
+    """Loads new files in micro-batches; a batch is loaded once it holds
+    `max_batch` files, or its oldest file waited `max_latency` seconds"""
+    first_seen: float | None = None
+    while True:
+        paths = watcher.poll()
+        now = time.monotonic()
+        if not paths:
+            first_seen = None
+            watcher.wait(max_latency)
+            continue
+        if first_seen is None:
+            first_seen = now
+        if len(paths) < max_batch and now - first_seen < max_latency:
+            watcher.wait(first_seen + max_latency - now)
+            continue
+        batch = paths[:max_batch]
+        try:
+            loaded = adapter.load_batch(batch)
+        except (OSError, sqlite3.OperationalError) as err:
+            # E.g. the database is locked or the disk is full; the batch isn't
+            # committed, so it's retried after a pause
+            print(f"Can't load {len(batch)} new files, retrying: {err}")
+            watcher.wait(max_latency)
+            continue
+        watcher.commit(batch)
+        print(f"Loaded {loaded} of {len(batch)} new files")
+        first_seen = now if len(paths) > max_batch else None
+
+
 def main():
     parser = argparse.ArgumentParser(
         prog="Greenhouse climate CLI",
-        description="Simple CLI for uploading weather data in bulk",
+        description="Simple CLI for uploading and maintaining weather data",
     )
-
-    parser.add_argument("path", help="Path to iteratively traverse for raw data")
-    parser.add_argument(
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
         "--database-url",
         dest="db",
         default="./data/db.sqlite",
         help="URL for database (default ./data/db.sqlite)",
     )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    load = subparsers.add_parser(
+        "load", parents=[common], help="Upload weather data in bulk"
+    )
+    load.add_argument("path", help="Path to iteratively traverse for raw data")
+    load.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep following the path, and load new files as they appear",
+    )
+    load.add_argument(
+        "--max-latency",
+        type=float,
+        default=5.0,
+        help="Seconds a new file may wait for its batch to be loaded (default 5)",
+    )
+    load.add_argument(
+        "--max-batch",
+        type=int,
+        default=500,
+        help="Maximum number of files loaded per transaction (default 500)",
+    )
+    load.add_argument(
+        "--state-file",
+        help="Where watch progress is kept (default <database-url>.watch.json)",
+    )
+
+    compact = subparsers.add_parser(
+        "compact",
+        parents=[common],
+        help="Downsample raw data older than the retention period",
+    )
+    compact.add_argument(
+        "--max-age-days",
+        type=int,
+        default=365,
+        help="Raw data older than this is compacted (default 365)",
+    )
+    compact.add_argument(
+        "--interval-seconds",
+        type=int,
+        default=3600,
+        help="Bucket size of compacted data (default 3600)",
+    )
+    compact.add_argument(
+        "--batch-seconds",
+        type=int,
+        default=86400,
+        help="Range of raw data compacted per transaction (default 86400)",
+    )
+
+    subparsers.add_parser(
+        "sketch",
+        parents=[common],
+        help="Rebuild the percentile sketches from raw data",
+    )
+
+    rename = subparsers.add_parser(
+        "rename-station",
+        parents=[common],
+        help="Move all data of a station to another id",
+    )
+    rename.add_argument("old", help="Current station id, e.g. default")
+    rename.add_argument("new", help="New station id")
+
+    delete = subparsers.add_parser(
+        "delete-station",
+        parents=[common],
+        help="Delete all data of a station, e.g. test data",
+    )
+    delete.add_argument("station_id", help="Station id, e.g. loadtest")
+
+    export = subparsers.add_parser(
+        "export", parents=[common], help="Export stored data to a file"
+    )
+    export.add_argument("output", help="File to write to")
+    export.add_argument(
+        "--after", type=datetime.fromisoformat, required=True, help="Start of range"
+    )
+    export.add_argument(
+        "--before", type=datetime.fromisoformat, required=True, help="End of range"
+    )
+    export.add_argument(
+        "--format",
+        dest="fmt",
+        choices=["parquet", "arrow", "csv"],
+        default="csv",
+        help="File format; parquet and arrow require pyarrow (default csv)",
+    )
+    export.add_argument("--station-id", help="Station to export (default all stations)")
+
     args = parser.parse_args()
     interactor = get_interactor(args.db)
-    interactor.load(file_path_generator(args.path))
+    if args.command == "load" and args.watch:
+        watcher = DirectoryWatcher(
+            args.path, args.state_file or f"{args.db}.watch.json"
+        )
+        try:
+            watch(interactor, watcher, args.max_latency, args.max_batch)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+    elif args.command == "load":
+        interactor.load(file_path_generator(args.path))
+    elif args.command == "compact":
+        interactor.compact(args.max_age_days, args.interval_seconds, args.batch_seconds)
+    elif args.command == "rename-station":
+        interactor.rename_station(args.old, args.new)
+    elif args.command == "delete-station":
+        interactor.delete_station(args.station_id)
+    elif args.command == "sketch":
+        interactor.rebuild_sketches()
+    elif args.command == "export":
+        interactor.export(
+            args.after, args.before, args.station_id, args.fmt, args.output
+        )
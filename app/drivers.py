@@ -29,8 +29,8 @@ class SQLiteCursor(SQLCursor):
         self._cur = cursor
 
     @_sqlite_exception_handler
-    def execute(self, sql: str):
-        self._cur = self._cur.execute(sql)
+    def execute(self, sql: str, parameters: dict[str, Any] | None = None):
+        self._cur = self._cur.execute(sql, parameters or {})
 
     @_sqlite_exception_handler
     def executemany(self, sql: str, parameters: Iterable):
@@ -40,6 +40,10 @@ class SQLiteCursor(SQLCursor):
     def fetchone(self) -> dict[str, Any] | None:
         return self._cur.fetchone()
 
+    @_sqlite_exception_handler
+    def fetchmany(self, size: int) -> list[dict[str, Any]]:
+        return self._cur.fetchmany(size)
+
     @_sqlite_exception_handler
     def fetchall(self) -> list[dict[str, Any]]:
         return self._cur.fetchall()
@@ -49,14 +53,26 @@ class SQLiteCursor(SQLCursor):
     def lastrowid(self) -> int | None:
         return self._cur.lastrowid
 
+    @property
+    @_sqlite_exception_handler
+    def rowcount(self) -> int:
+        return self._cur.rowcount
+
 
 class SQLiteConnection(SQLConnection):
     """Very thin wrapper around sqlite3.Connection"""
 
     def __init__(self, path: str | bytes | os.PathLike) -> None:
-        self._conn = sqlite3.connect(path)
+        self._path = path
+        # A connection is never used concurrently, but a streamed response may
+        # read from it on another thread than the one that opened it
+        self._conn = sqlite3.connect(path, check_same_thread=False)
         self._conn.row_factory = self._dict_factory
 
+    def reopen(self) -> "SQLiteConnection":
+        """Another connection to the same database"""
+        return SQLiteConnection(self._path)
+
     def cursor(self) -> SQLCursor:
         return SQLiteCursor(self._conn.cursor())
 
@@ -64,6 +80,10 @@ class SQLiteConnection(SQLConnection):
     def commit(self):
         self._conn.commit()
 
+    @_sqlite_exception_handler
+    def rollback(self):
+        self._conn.rollback()
+
     @_sqlite_exception_handler
     def close(self):
         return self._conn.close()
@@ -1,8 +1,10 @@
 """Holds key entities (i.e. the data objects)"""
 from __future__ import annotations
 
-from datetime import datetime
+from array import array
+from datetime import datetime, timezone, tzinfo
 from enum import Enum
+from typing import Any, Iterable, Iterator, Mapping, overload
 
 from pydantic import BaseModel
 
@@ -20,6 +22,7 @@ class Token(BaseModel):
 
 class WeatherData(BaseModel):
 
+    station_id: str | None = None  # None for aggregates over all stations
     timestamp: datetime
     external_temperature_c: float
     wind_speed_unmuted_m_s: float
@@ -42,3 +45,163 @@ class WeatherData(BaseModel):
 
     def __lt__(self, o: WeatherData):
         return self.timestamp < o.timestamp
+
+
+class WeatherPercentiles(BaseModel):
+    """Estimated percentiles of a channel over a period"""
+
+    timestamp: datetime  # Start of the period
+    channel: str
+    count: int  # Number of samples the estimate is based on
+    values: list[float | None]  # One per requested percentile
+
+
+CHANNELS: tuple[str, ...] = tuple(
+    key for key in WeatherData.__fields__ if key not in ("station_id", "timestamp")
+)
+
+
+class WeatherRecord:
+    """Lightweight row of a `WeatherBatch`; `timestamp` is in epoch seconds"""
+
+    __slots__ = ("station_id", "timestamp", *CHANNELS)
+
+    station_id: str | None
+    timestamp: int
+    external_temperature_c: float
+    wind_speed_unmuted_m_s: float
+    wind_speed_m_s: float
+    wind_direction_degrees: float
+    radiation_intensity_unmuted_w_m2: float
+    radiation_intensity_w_m2: float
+    standard_radiation_intensity_w_m2: float
+    radiation_sum_j_cm2: float
+    radiation_from_plant_w_m2: float
+    precipitation: float
+    relative_humidity_perc: float
+    moisture_deficit_g_kg: float
+    moisture_deficit_g_m3: float
+    dew_point_temperature_c: float
+    abs_humidity_g_kg: float
+    enthalpy_kj_kg: float
+    enthalpy_kj_m3: float
+    atmospheric_pressure_hpa: float
+
+    def __init__(self, station_id: str | None, timestamp: int, *values: float):
+        self.station_id = station_id
+        self.timestamp = timestamp
+        for key, value in zip(CHANNELS, values, strict=True):
+            setattr(self, key, value)
+
+    def __repr__(self) -> str:
+        return f"WeatherRecord({self.station_id!r}, {self.timestamp})"
+
+
+class WeatherBatch:
+    """Columnar batch of weather data, for bulk paths
+
+    Timestamps (epoch seconds) are held in an int64 array, and every channel in
+    a float64 array. Station ids are dictionary encoded: per row an index into
+    `stations`. Slicing a batch doesn't copy any data.
+    """
+
+    __slots__ = ("stations", "_codes", "_timestamps", "_channels")
+
+    def __init__(
+        self,
+        stations: list[str | None],
+        codes: array[int] | memoryview,
+        timestamps: array[int] | memoryview,
+        channels: dict[str, array[float] | memoryview],
+    ) -> None:
+        if set(channels) != set(CHANNELS):
+            raise ValueError("A batch needs exactly one array per channel")
+        if any(len(column) != len(timestamps) for column in channels.values()):
+            raise ValueError("All columns of a batch should be of equal length")
+        if len(codes) != len(timestamps):
+            raise ValueError("All columns of a batch should be of equal length")
+        self.stations = stations
+        self._codes = memoryview(codes)
+        self._timestamps = memoryview(timestamps)
+        self._channels = {key: memoryview(channels[key]) for key in CHANNELS}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Mapping[str, Any]]) -> WeatherBatch:
+        """Builds a batch from mappings with a `station_id`, a `timestamp`
+        (datetime or epoch seconds) and a value per channel; other keys are
+        ignored, values are coerced to float"""
+        stations: dict[str | None, int] = {}
+        codes = array("i")
+        timestamps = array("q")
+        channels = {key: array("d") for key in CHANNELS}
+        for row in rows:
+            station_id = row.get("station_id")
+            codes.append(stations.setdefault(station_id, len(stations)))
+            ts = row["timestamp"]
+            timestamps.append(int(ts.timestamp()) if isinstance(ts, datetime) else ts)
+            try:
+                for key, column in channels.items():
+                    column.append(float(row[key]))
+            except KeyError as err:
+                raise ValueError(f"Missing value for {err}") from err
+            except TypeError as err:
+                raise ValueError(f"Invalid value: {err}") from err
+        return cls(list(stations), codes, timestamps, dict(channels))
+
+    @classmethod
+    def from_weather(cls, data: Iterable[WeatherData]) -> WeatherBatch:
+        return cls.from_rows(entry.__dict__ for entry in data)
+
+    def to_weather(self, tz: tzinfo = timezone.utc) -> list[WeatherData]:
+        """Converts to entities; the data is trusted, so not validated again"""
+        keys = ("station_id", "timestamp", *CHANNELS)
+        return [
+            WeatherData.construct(**dict(zip(keys, values, strict=True)))
+            for values in zip(
+                self.station_ids(),
+                (datetime.fromtimestamp(ts, tz=tz) for ts in self._timestamps),
+                *self._channels.values(),
+                strict=True,
+            )
+        ]
+
+    def station_ids(self) -> Iterator[str | None]:
+        return map(self.stations.__getitem__, self._codes)
+
+    @property
+    def timestamps(self) -> memoryview:
+        return self._timestamps
+
+    def column(self, key: str) -> memoryview:
+        return self._channels[key]
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    @overload
+    def __getitem__(self, index: int) -> WeatherRecord:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> WeatherBatch:
+        ...
+
+    def __getitem__(self, index: int | slice) -> WeatherRecord | WeatherBatch:
+        if isinstance(index, slice):
+            return WeatherBatch(
+                self.stations,
+                self._codes[index],
+                self._timestamps[index],
+                {key: column[index] for key, column in self._channels.items()},
+            )
+        return WeatherRecord(
+            self.stations[self._codes[index]],
+            self._timestamps[index],
+            *(column[index] for column in self._channels.values()),
+        )
+
+    def __iter__(self) -> Iterator[WeatherRecord]:
+        for station_id, ts, *values in zip(
+            self.station_ids(), self._timestamps, *self._channels.values(), strict=True
+        ):
+            yield WeatherRecord(station_id, ts, *values)
@@ -15,3 +15,12 @@ class DatabaseError(WeatherAppError):
 
 class DatabaseIntegrityError(WeatherAppError):
     """Thrown when trying to insert data the violates database constraints"""
+
+
+class DataNotFoundError(WeatherAppError):
+    """Thrown when there is no data to answer a query, e.g. for an unknown
+    station"""
+
+
+class UnsupportedFormatError(WeatherAppError):
+    """Thrown when data can't be exported to the requested format"""
@@ -0,0 +1,157 @@
+"""Responsible for writing columnar batches of weather data to file formats"""
+
+import csv
+import io
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator, Literal
+
+from .entities import CHANNELS
+from .exceptions import UnsupportedFormatError
+
+try:
+    import pyarrow as pa  # type: ignore[import]
+    import pyarrow.parquet as pq  # type: ignore[import]
+except ImportError:  # pragma: no cover - Parquet/Arrow support is optional
+    pa = None
+    pq = None
+
+ExportFormat = Literal["csv", "parquet", "arrow"]
+Batch = dict[str, list[Any]]
+
+MEDIA_TYPES: dict[str, str] = {
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+_SECONDS_PER_DAY = 86400
+COLUMNS = ["station_id", "timestamp", *CHANNELS, "samples"]
+
+
+class _ByteSink:
+    """Write-only file object that hands out what was written so far; keeps
+    track of the absolute position, which Parquet needs for its footer"""
+
+    closed = False
+
+    def __init__(self) -> None:
+        self._buffer = io.BytesIO()
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        self._position += len(data)
+        return self._buffer.write(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def export(batches: Iterable[Batch], fmt: ExportFormat) -> Iterator[bytes]:
+    """Encodes batches of columns in the given format, yielding the encoded
+    bytes as they become available"""
+    writers: dict[str, Callable[[Iterable[Batch], _ByteSink], Iterator[None]]] = {
+        "csv": _write_csv,
+        "parquet": _write_parquet,
+        "arrow": _write_arrow,
+    }
+    if fmt in ("parquet", "arrow") and pa is None:
+        raise UnsupportedFormatError(f"Exporting to {fmt} requires pyarrow")
+    return _drain(writers[fmt], batches)
+
+
+def _drain(
+    writer: Callable[[Iterable[Batch], _ByteSink], Iterator[None]],
+    batches: Iterable[Batch],
+) -> Iterator[bytes]:
+    sink = _ByteSink()
+    for _ in writer(batches, sink):
+        if data := sink.drain():
+            yield data
+    if data := sink.drain():
+        yield data
+
+
+def _write_csv(batches: Iterable[Batch], sink: _ByteSink) -> Iterator[None]:
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        columns = [batch[key] for key in COLUMNS]
+        columns[1] = [
+            datetime.fromtimestamp(ts, tz=timezone.utc).isoformat() for ts in columns[1]
+        ]
+        writer.writerows(zip(*columns, strict=True))
+        sink.write(text.getvalue().encode())
+        text.seek(0)
+        text.truncate()
+        yield
+    sink.write(text.getvalue().encode())
+
+
+def _schema() -> "pa.Schema":
+    return pa.schema(
+        [
+            pa.field("station_id", pa.string()),
+            pa.field("timestamp", pa.timestamp("s", tz="UTC")),
+            *[pa.field(key, pa.float64()) for key in CHANNELS],
+            pa.field("samples", pa.int64()),
+        ]
+    )
+
+
+def _write_parquet(batches: Iterable[Batch], sink: _ByteSink) -> Iterator[None]:
+    """Writes one row group per (UTC) day"""
+    schema = _schema()
+    writer = pq.ParquetWriter(sink, schema)
+    pending: list["pa.RecordBatch"] = []
+    day = None
+    for batch in batches:
+        # Batches are sorted by timestamp, so split them where the day changes
+        timestamps = batch["timestamp"]
+        start = 0
+        for i, ts in enumerate(timestamps):
+            if ts // _SECONDS_PER_DAY != day:
+                if i > start:
+                    pending.append(_record_batch(batch, schema, start, i))
+                if pending:
+                    writer.write_table(pa.Table.from_batches(pending, schema))
+                    pending = []
+                    yield
+                day = ts // _SECONDS_PER_DAY
+                start = i
+        pending.append(_record_batch(batch, schema, start, len(timestamps)))
+    if pending:
+        writer.write_table(pa.Table.from_batches(pending, schema))
+    writer.close()
+    yield
+
+
+def _write_arrow(batches: Iterable[Batch], sink: _ByteSink) -> Iterator[None]:
+    schema = _schema()
+    writer = pa.ipc.new_stream(sink, schema)
+    for batch in batches:
+        writer.write_batch(_record_batch(batch, schema, 0, len(batch["timestamp"])))
+        yield
+    writer.close()
+    yield
+
+
+def _record_batch(
+    batch: Batch, schema: "pa.Schema", start: int, end: int
+) -> "pa.RecordBatch":
+    return pa.record_batch(
+        [pa.array(batch[field.name][start:end], type=field.type) for field in schema],
+        schema=schema,
+    )
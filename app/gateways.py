@@ -1,11 +1,20 @@
 """Gateways to database, responsible for turning SQL based data into entities"""
 
+import math
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone, tzinfo
-from typing import Any, Iterable, Protocol
+from typing import Any, Callable, Iterable, Iterator, Literal, Protocol
 
-from app.entities import WeatherData
+from app.entities import CHANNELS, WeatherBatch, WeatherData
 
+from .exceptions import DataNotFoundError
 from .interactors import WeatherDbGateway
+from .profiling import phase
+from .resampling import aligned_grid
+from .sketches import TDigest
+
+_SECONDS_PER_DAY = 86400
 
 
 def _load_query(filename: str) -> str:
@@ -17,7 +26,7 @@ def _load_query(filename: str) -> str:
 class SQLCursor(Protocol):
     """Stricter implementation of PEP249 Connection object"""
 
-    def execute(self, sql: str):
+    def execute(self, sql: str, parameters: dict[str, Any] | None = None):
         ...
 
     def executemany(self, sql: str, parameters: Iterable):
@@ -26,6 +35,9 @@ class SQLCursor(Protocol):
     def fetchone(self) -> dict[str, Any] | None:
         ...
 
+    def fetchmany(self, size: int) -> list[dict[str, Any]]:
+        ...
+
     def fetchall(self) -> list[dict[str, Any]]:
         ...
 
@@ -33,6 +45,10 @@ class SQLCursor(Protocol):
     def lastrowid(self) -> int | None:
         ...
 
+    @property
+    def rowcount(self) -> int:
+        ...
+
 
 class SQLConnection(Protocol):
     """Stricter implementation of PEP249 Cursor object"""
@@ -43,6 +59,12 @@ class SQLConnection(Protocol):
     def commit(self):
         ...
 
+    def rollback(self):
+        ...
+
+    def close(self):
+        ...
+
 
 class SQLWeatherDbGateway(WeatherDbGateway):
     """Responsible for turning SQL based data into entities and vice versa"""
@@ -53,66 +75,467 @@ class SQLWeatherDbGateway(WeatherDbGateway):
         "latest": _load_query("./app/sql/weather_get_latest.sql"),
         "between": _load_query("./app/sql/weather_get_between.sql"),
         "average": _load_query("./app/sql/weather_get_average_since.sql"),
+        "rolling": _load_query("./app/sql/weather_get_rolling.sql"),
+        "compact": _load_query("./app/sql/weather_compact.sql"),
+        "compaction": _load_query("./app/sql/weather_compaction_update.sql"),
+        "delete": _load_query("./app/sql/weather_delete_between.sql"),
+        "export": _load_query("./app/sql/weather_export.sql"),
+        "sketch_get": _load_query("./app/sql/weather_sketch_get.sql"),
+        "sketch_upsert": _load_query("./app/sql/weather_sketch_upsert.sql"),
+        "sketch_between": _load_query("./app/sql/weather_sketch_between.sql"),
+        "sketch_clear": _load_query("./app/sql/weather_sketch_clear.sql"),
+        "sketch_source": _load_query("./app/sql/weather_sketch_source.sql"),
     }
+    # Compacted rows stand for `samples` raw rows, so aggregates are weighted
+    _divisors = {"mean": " / sum(samples) OVER win", "sum": ""}
 
-    def __init__(self, conn: SQLConnection):
+    def __init__(
+        self,
+        conn: SQLConnection,
+        connect: Callable[[], SQLConnection] | None = None,
+        parallelism: int = 1,
+        split_threshold: timedelta = timedelta(days=90),
+    ):
+        """Given a `connect` factory and a `parallelism` above 1, `get_between`
+        splits ranges longer than `split_threshold` into that many sub-ranges,
+        each queried on a connection of its own"""
         self._conn = conn
+        self._connect = connect
+        self._parallelism = parallelism
+        self._split_threshold = split_threshold
 
-    def load(self, weather: Iterable[WeatherData]) -> None:
-        data_generator = map(lambda x: self._weather_to_row(x), weather)
+    def load(self, weather: Iterable[WeatherData] | WeatherBatch) -> None:
+        """Inserts the data, and updates the sketches of the days it covers, in
+        a single transaction"""
+        if isinstance(weather, WeatherBatch):
+            batch = weather
+        else:
+            batch = WeatherBatch.from_weather(weather)
         cur = self._conn.cursor()
         operation = self._queries["insert"]
-        cur.executemany(operation, data_generator)
+        try:
+            cur.executemany(operation, self._batch_to_rows(batch))
+            self._update_sketches(cur, batch)
+        except Exception:
+            # Don't leave a partially inserted batch behind for the next commit
+            self._conn.rollback()
+            raise
         self._conn.commit()
 
-    def get_latest(self, tz: tzinfo = timezone.utc) -> WeatherData:
+    def get_latest(
+        self, station_id: str | None = None, tz: tzinfo = timezone.utc
+    ) -> WeatherData:
         cur = self._conn.cursor()
-        operation = self._queries["latest"]
-        cur.execute(operation)
-        row = cur.fetchone()
+        operation = self._queries["latest"].format(
+            station_filter=self._station_filter(station_id)
+        )
+        with phase("sql"):
+            cur.execute(operation, {"station_id": station_id})
+            row = cur.fetchone()
         if not row:
-            raise Exception("Couldn't get latest row; is there data at all?")
-        return self._row_to_weather(row, tz=tz)
+            raise DataNotFoundError(self._no_data_message(station_id))
+        with phase("row_to_weather"):
+            return self._row_to_weather(row, tz=tz)
 
     def get_between(
         self,
         after: datetime,
         before: datetime,
         interval: timedelta,
+        station_id: str | None = None,
         tz: tzinfo = timezone.utc,
     ) -> list[WeatherData]:
+        ranges = self._split_between(after, before, interval, tz)
+        with phase("sql"):
+            if len(ranges) == 1:
+                cur = self._execute_between(after, before, interval, station_id, tz)
+                rows = cur.fetchall()
+            else:
+                # SQLite releases the GIL while it runs a query, so threads do
+                # run the queries in parallel
+                with ThreadPoolExecutor(len(ranges)) as executor:
+                    chunks = executor.map(
+                        lambda r: self._fetch_between(
+                            r[0], r[1], interval, station_id, tz
+                        ),
+                        ranges,
+                    )
+                    rows = [row for chunk in chunks for row in chunk]
+        with phase("row_to_weather"):
+            return [self._row_to_weather(row, tz=tz) for row in rows]
+
+    def iter_between(
+        self,
+        after: datetime,
+        before: datetime,
+        interval: timedelta,
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
+        chunk_size: int = 1000,
+    ) -> Iterator[WeatherData]:
+        """Like `get_between`, but fetches rows lazily, `chunk_size` at a time"""
+        with phase("sql"):
+            cur = self._execute_between(after, before, interval, station_id, tz)
+        while True:
+            with phase("sql"):
+                rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return
+            with phase("row_to_weather"):
+                chunk = [self._row_to_weather(row, tz=tz) for row in rows]
+            yield from chunk
+
+    def iter_columns(
+        self,
+        after: datetime,
+        before: datetime,
+        station_id: str | None = None,
+        batch_size: int = 10000,
+    ) -> Iterator[dict[str, list[Any]]]:
+        """Yields raw and compacted data in columnar batches of at most
+        `batch_size` rows, sorted by timestamp; timestamps are in epoch seconds
+        and compacted rows have `samples` > 1"""
         cur = self._conn.cursor()
+        operation = self._queries["export"].format(
+            **{
+                "station_filter": self._station_filter(station_id),
+                "timestamp_after": int(after.timestamp()),
+                "timestamp_before": int(before.timestamp()),
+            }
+        )
+        cur.execute(operation, {"station_id": station_id})
+        while rows := cur.fetchmany(batch_size):
+            yield {key: [row[key] for row in rows] for key in rows[0]}
+
+    def _split_between(
+        self, after: datetime, before: datetime, interval: timedelta, tz: tzinfo
+    ) -> list[tuple[datetime, datetime]]:
+        """Splits the range at bucket boundaries into at most `parallelism`
+        ranges of about as many buckets. Since no bucket spans two ranges, the
+        results of the ranges simply add up to that of the whole range."""
+        interval_seconds = interval.total_seconds()
+        if (
+            self._connect is None
+            or self._parallelism < 2
+            or before - after < self._split_threshold
+            or not interval_seconds.is_integer()
+        ):
+            return [(after, before)]
+        offset = tz.utcoffset(None) or timedelta(0)
+        grid = aligned_grid(
+            int(after.timestamp()),
+            int(before.timestamp()),
+            int(interval_seconds),
+            int(offset.total_seconds()),
+        )
+        if len(grid) < 2:
+            return [(after, before)]
+        size = math.ceil(len(grid) / self._parallelism)
+        # Both ends are bucket starts; rows before the first bucket wouldn't
+        # be returned anyway, and `before` is the start of the last bucket
+        return [
+            (
+                datetime.fromtimestamp(buckets[0], tz=timezone.utc),
+                datetime.fromtimestamp(buckets[-1], tz=timezone.utc),
+            )
+            for buckets in (grid[i : i + size] for i in range(0, len(grid), size))
+        ]
+
+    def _fetch_between(
+        self,
+        after: datetime,
+        before: datetime,
+        interval: timedelta,
+        station_id: str | None,
+        tz: tzinfo,
+    ) -> list[dict[str, Any]]:
+        assert self._connect is not None
+        conn = self._connect()
+        try:
+            cur = self._execute_between(after, before, interval, station_id, tz, conn)
+            return cur.fetchall()
+        finally:
+            conn.close()
+
+    def _execute_between(
+        self,
+        after: datetime,
+        before: datetime,
+        interval: timedelta,
+        station_id: str | None,
+        tz: tzinfo,
+        conn: SQLConnection | None = None,
+    ) -> SQLCursor:
+        cur = (conn or self._conn).cursor()
+        offset = tz.utcoffset(None) or timedelta(0)
         operation = self._queries["between"].format(
             **{
+                "station_filter": self._station_filter(station_id),
                 "interval_seconds": interval.total_seconds(),
+                "offset_seconds": int(offset.total_seconds()),
                 "timestamp_after": int(after.timestamp()),
                 "timestamp_before": int(before.timestamp()),
             }
         )
-        cur.execute(operation)
-        return [self._row_to_weather(row, tz=tz) for row in cur.fetchall()]
+        cur.execute(operation, {"station_id": station_id})
+        return cur
 
     def get_average_since(
-        self, since: datetime, tz: tzinfo = timezone.utc
+        self,
+        since: datetime,
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
     ) -> WeatherData:
         cur = self._conn.cursor()
         operation = self._queries["average"].format(
-            **{"timestamp_since": int(since.timestamp())}
+            **{
+                "station_filter": self._station_filter(station_id),
+                "timestamp_since": int(since.timestamp()),
+            }
         )
-        cur.execute(operation)
+        with phase("sql"):
+            cur.execute(operation, {"station_id": station_id})
+            row = cur.fetchone()
+        # Aggregates always return a row; without data, its timestamp is NULL
+        if not row or row["timestamp"] is None:
+            raise DataNotFoundError(
+                f"{self._no_data_message(station_id)} since {since.isoformat()}"
+            )
+        with phase("row_to_weather"):
+            return self._row_to_weather(row, tz=tz)
+
+    def get_rolling(
+        self,
+        after: datetime,
+        before: datetime,
+        window: timedelta,
+        step: timedelta,
+        aggregate: Literal["mean", "sum"] = "mean",
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
+    ) -> list[WeatherData]:
+        # Window functions with an invertible aggregate (avg, sum) are updated
+        # incrementally by SQLite, so this is a single pass over the range
+        cur = self._conn.cursor()
+        offset = tz.utcoffset(None) or timedelta(0)
+        window_seconds = int(window.total_seconds())
+        operation = self._queries["rolling"].format(
+            **{
+                "station_filter": self._station_filter(station_id),
+                "divisor": self._divisors[aggregate],
+                "window_seconds": window_seconds,
+                "window_preceding": window_seconds - 1,
+                "step_seconds": int(step.total_seconds()),
+                "offset_seconds": int(offset.total_seconds()),
+                "timestamp_after": int(after.timestamp()),
+                "timestamp_before": int(before.timestamp()),
+            }
+        )
+        with phase("sql"):
+            cur.execute(operation, {"station_id": station_id})
+            rows = cur.fetchall()
+        with phase("row_to_weather"):
+            return [self._row_to_weather(row, tz=tz) for row in rows]
+
+    def compact(self, before: datetime, interval: timedelta, batch: timedelta) -> int:
+        """Rolls raw rows older than `before` into buckets of size `interval`,
+        one transaction per `batch`; returns the number of raw rows removed.
+        The interval can't change once data is compacted, since buckets of
+        different sizes would overlap."""
+        interval_seconds = int(interval.total_seconds())
+        batch_seconds = int(batch.total_seconds())
+        cur = self._conn.cursor()
+        cur.execute("SELECT interval_seconds FROM weather_compaction;")
         row = cur.fetchone()
-        if not row:
-            raise Exception("Couldn't get average; is there data at all?")
-        return self._row_to_weather(row, tz=tz)
+        if row and row["interval_seconds"] != interval_seconds:
+            raise ValueError(
+                f"Data is compacted to buckets of {row['interval_seconds']} "
+                f"seconds, so can't be compacted to {interval_seconds} seconds"
+            )
+        # Align to bucket boundaries, so no bucket is split over two runs
+        cutoff = int(before.timestamp())
+        cutoff -= cutoff % interval_seconds
+        batch_seconds = max(
+            batch_seconds - batch_seconds % interval_seconds, interval_seconds
+        )
+        cur.execute(f"SELECT min(timestamp) timestamp FROM {self._table_name};")
+        row = cur.fetchone()
+        if not row or row["timestamp"] is None:
+            return 0
+        start = row["timestamp"] - row["timestamp"] % interval_seconds
+        removed = 0
+        for after in range(start, cutoff, batch_seconds):
+            parameters = {
+                "interval_seconds": interval_seconds,
+                "timestamp_after": after,
+                "timestamp_before": min(after + batch_seconds, cutoff),
+            }
+            cur.execute(self._queries["compact"].format(**parameters))
+            cur.execute(self._queries["delete"].format(**parameters))
+            removed += cur.rowcount
+            # From here on, raw rows for this range are refused
+            cur.execute(self._queries["compaction"].format(**parameters))
+            self._conn.commit()
+        # Only has effect if the database was created with incremental auto vacuum
+        cur.execute("PRAGMA incremental_vacuum;")
+        cur.fetchall()
+        return removed
+
+    def iter_sketches(
+        self,
+        after: datetime,
+        before: datetime,
+        channels: Iterable[str] = CHANNELS,
+        station_id: str | None = None,
+    ) -> Iterator[tuple[datetime, str, TDigest]]:
+        """Yields (day, channel, sketch) for all (UTC) days that overlap the
+        range, ordered by day; without a station, there's a sketch per station"""
+        cur = self._conn.cursor()
+        parameters: dict[str, Any] = {"station_id": station_id}
+        for i, channel in enumerate(channels):
+            parameters[f"channel_{i}"] = channel
+        operation = self._queries["sketch_between"].format(
+            **{
+                "station_filter": self._station_filter(station_id),
+                "channels": ", ".join(
+                    f":{key}" for key in parameters if key != "station_id"
+                ),
+                "day_after": math.floor(after.timestamp() / _SECONDS_PER_DAY),
+                "day_before": math.ceil(before.timestamp() / _SECONDS_PER_DAY),
+            }
+        )
+        with phase("sql"):
+            cur.execute(operation, parameters)
+            rows = cur.fetchall()
+        for row in rows:
+            day = datetime.fromtimestamp(row["day"] * _SECONDS_PER_DAY, tz=timezone.utc)
+            yield day, row["channel"], TDigest.from_bytes(row["digest"])
+
+    def rebuild_sketches(self, batch_size: int = 10000) -> int:
+        """Rebuilds the sketches of all days from raw data; returns the number
+        of rows sketched. Days (of a station) that are compacted, even in part,
+        can't be sketched again, so their sketches are kept as they are."""
+        read = self._conn.cursor()
+        write = self._conn.cursor()
+        write.execute(self._queries["sketch_clear"])
+        read.execute(self._queries["sketch_source"])
+        count = 0
+        try:
+            while rows := read.fetchmany(batch_size):
+                self._update_sketches(write, WeatherBatch.from_rows(rows))
+                count += len(rows)
+        except Exception:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+        return count
+
+    def rename_station(self, old: str, new: str) -> int:
+        """Moves all data of station `old` to `new`, e.g. to merge data stored
+        under two ids; fails if both have data for the same timestamp. Returns
+        the number of rows moved."""
+        cur = self._conn.cursor()
+        parameters = {"old": old, "new": new}
+        try:
+            moved = 0
+            for table in (self._table_name, "weather_compacted"):
+                cur.execute(
+                    f"UPDATE {table} SET station_id = :new WHERE station_id = :old;",
+                    parameters,
+                )
+                moved += cur.rowcount
+            # Both may have a sketch for the same day, so merge those
+            cur.execute(
+                "SELECT day, channel, digest FROM weather_sketch "
+                "WHERE station_id = :old;",
+                parameters,
+            )
+            sketches = cur.fetchall()
+            for row in sketches:
+                cur.execute(self._queries["sketch_get"], {"station_id": new, **row})
+                digest = TDigest.from_bytes(row["digest"])
+                for existing in cur.fetchall():
+                    if existing["channel"] == row["channel"]:
+                        digest.merge(TDigest.from_bytes(existing["digest"]))
+                cur.execute(
+                    self._queries["sketch_upsert"],
+                    {**row, "station_id": new, "digest": digest.to_bytes()},
+                )
+            cur.execute(
+                "DELETE FROM weather_sketch WHERE station_id = :old;", parameters
+            )
+        except Exception:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+        return moved
+
+    def delete_station(self, station_id: str) -> int:
+        """Deletes all data and sketches of a station; returns the number of
+        rows deleted"""
+        cur = self._conn.cursor()
+        parameters = {"station_id": station_id}
+        try:
+            deleted = 0
+            for table in (self._table_name, "weather_compacted"):
+                cur.execute(
+                    f"DELETE FROM {table} WHERE station_id = :station_id;",
+                    parameters,
+                )
+                deleted += cur.rowcount
+            cur.execute(
+                "DELETE FROM weather_sketch WHERE station_id = :station_id;",
+                parameters,
+            )
+        except Exception:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+        return deleted
+
+    def _update_sketches(self, cur: SQLCursor, batch: WeatherBatch) -> None:
+        # Row indices per station and day
+        groups: dict[tuple[str | None, int], list[int]] = defaultdict(list)
+        for i, (station_id, ts) in enumerate(
+            zip(batch.station_ids(), batch.timestamps, strict=True)
+        ):
+            groups[station_id, ts // _SECONDS_PER_DAY].append(i)
+        for (station_id, day), indices in groups.items():
+            parameters: dict[str, Any] = {"station_id": station_id, "day": day}
+            cur.execute(self._queries["sketch_get"], parameters)
+            digests = {
+                row["channel"]: TDigest.from_bytes(row["digest"])
+                for row in cur.fetchall()
+            }
+            updates: list[dict[str, Any]] = []
+            for key in CHANNELS:
+                column = batch.column(key)
+                digest = digests.get(key) or TDigest()
+                digest.add(column[i] for i in indices)
+                updates.append(
+                    {**parameters, "channel": key, "digest": digest.to_bytes()}
+                )
+            cur.executemany(self._queries["sketch_upsert"], updates)
+
+    @staticmethod
+    def _no_data_message(station_id: str | None) -> str:
+        return "No data" if station_id is None else f"No data for station {station_id}"
+
+    @staticmethod
+    def _station_filter(station_id: str | None) -> str:
+        """Without a station, queries aggregate over all stations"""
+        return "station_id = :station_id AND " if station_id is not None else ""
 
     @staticmethod
     def _row_to_weather(row: dict[str, Any], tz: tzinfo = timezone.utc) -> WeatherData:
-        row = row.copy()  # Prevent side effects
-        row["timestamp"] = datetime.fromtimestamp(row["timestamp"], tz=tz)
-        return WeatherData(**row)
+        values = dict(row)  # Prevent side effects
+        values["timestamp"] = datetime.fromtimestamp(row["timestamp"], tz=tz)
+        # Rows come from our own schema, so skip validation
+        return WeatherData.construct(**values)
 
     @staticmethod
-    def _weather_to_row(weather: WeatherData) -> dict[str, Any]:
-        d = weather.dict()
-        d["timestamp"] = int(weather.timestamp.timestamp())
-        return d
+    def _batch_to_rows(batch: WeatherBatch) -> Iterator[dict[str, Any]]:
+        keys = ("station_id", "timestamp", *CHANNELS)
+        columns = [batch.column(key) for key in CHANNELS]
+        for values in zip(batch.station_ids(), batch.timestamps, *columns, strict=True):
+            yield dict(zip(keys, values, strict=True))
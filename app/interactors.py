@@ -1,23 +1,32 @@
 """Responsible for business logic"""
 
 from datetime import datetime, timedelta, timezone, tzinfo
-from typing import Iterable, Literal, Protocol
+from typing import Any, Iterable, Iterator, Literal, Protocol
 
 from jose import JWTError, jwt
 from pydantic import BaseModel, validator
 
-from .entities import Scope, Token, WeatherData
+from .entities import (
+    CHANNELS,
+    Scope,
+    Token,
+    WeatherBatch,
+    WeatherData,
+    WeatherPercentiles,
+)
 from .exceptions import AuthorizationError
+from .sketches import TDigest
 
 
 class WeatherDbGateway(Protocol):
     """Interface for getting weather data from database"""
 
-    def load(self, weather: Iterable[WeatherData]) -> None:
+    def load(self, weather: Iterable[WeatherData] | WeatherBatch) -> None:
         ...
 
     def get_latest(
         self,
+        station_id: str | None = None,
         tz: tzinfo = timezone.utc,
     ) -> WeatherData:
         ...
@@ -27,18 +36,93 @@ class WeatherDbGateway(Protocol):
         after: datetime,
         before: datetime,
         interval: timedelta,
+        station_id: str | None = None,
         tz: tzinfo = timezone.utc,
     ) -> list[WeatherData]:
         ...
 
+    def iter_between(
+        self,
+        after: datetime,
+        before: datetime,
+        interval: timedelta,
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
+        chunk_size: int = 1000,
+    ) -> Iterator[WeatherData]:
+        ...
+
+    def iter_columns(
+        self,
+        after: datetime,
+        before: datetime,
+        station_id: str | None = None,
+        batch_size: int = 10000,
+    ) -> Iterator[dict[str, list[Any]]]:
+        ...
+
     def get_average_since(
-        self, since: datetime, tz: tzinfo = timezone.utc
+        self,
+        since: datetime,
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
     ) -> WeatherData:
         ...
 
+    def get_rolling(
+        self,
+        after: datetime,
+        before: datetime,
+        window: timedelta,
+        step: timedelta,
+        aggregate: Literal["mean", "sum"] = "mean",
+        station_id: str | None = None,
+        tz: tzinfo = timezone.utc,
+    ) -> list[WeatherData]:
+        ...
+
+    def compact(self, before: datetime, interval: timedelta, batch: timedelta) -> int:
+        ...
+
+    def iter_sketches(
+        self,
+        after: datetime,
+        before: datetime,
+        channels: Iterable[str] = CHANNELS,
+        station_id: str | None = None,
+    ) -> Iterator[tuple[datetime, str, TDigest]]:
+        ...
+
+    def rebuild_sketches(self) -> int:
+        ...
+
+    def rename_station(self, old: str, new: str) -> int:
+        ...
+
+    def delete_station(self, station_id: str) -> int:
+        ...
+
+
+# Upper bound on the buckets a single query may produce; about two years at
+# the 5-minute resolution of the stations. Keeps a single request from tying up
+# a worker, e.g. when a gap-filled grid is built in Python.
+MAX_BUCKETS = 200_000
+
+
+def _check_buckets(values: dict[str, Any], step: timedelta, name: str) -> None:
+    """Validator helper; `values` holds the fields validated so far"""
+    if "after" not in values or "before" not in values:
+        return  # These failed validation already
+    if (values["before"] - values["after"]) / step > MAX_BUCKETS:
+        raise ValueError(
+            f"Range holds more than {MAX_BUCKETS} buckets; increase `{name}` or "
+            "shorten the range"
+        )
+
 
 class LatestWeatherQuery(BaseModel):
 
+    station_id: str | None = None
     tz_offset: timedelta = timedelta(seconds=0)
     kind: Literal["latest"] = "latest"
 
@@ -46,6 +130,7 @@ class LatestWeatherQuery(BaseModel):
 class AverageWeatherQuery(BaseModel):
 
     after: datetime
+    station_id: str | None = None
     tz_offset: timedelta = timedelta(seconds=0)
     kind: Literal["average"] = "average"
 
@@ -55,7 +140,10 @@ class TimeSeriesWeatherQuery(BaseModel):
     after: datetime
     before: datetime
     interval: timedelta
+    station_id: str | None = None
     tz_offset: timedelta = timedelta(seconds=0)
+    max_points: int | None = None
+    fill: Literal["null", "ffill", "linear"] | None = None
     kind: Literal["timeseries"] = "timeseries"
 
     @validator("before")
@@ -64,6 +152,117 @@ class TimeSeriesWeatherQuery(BaseModel):
             raise ValueError("`before` must be greater than `after`")
         return v
 
+    @validator("interval")
+    def interval_must_be_whole_seconds(cls, v, values, **kwargs):
+        if v < timedelta(seconds=1) or v % timedelta(seconds=1):
+            raise ValueError("`interval` must be a whole number of seconds, at least 1")
+        _check_buckets(values, v, "interval")
+        return v
+
+    @validator("max_points")
+    def max_points_must_be_at_least_three(cls, v, **kwargs):
+        if v is not None and v < 3:
+            raise ValueError("`max_points` must be at least 3")
+        return v
+
+    @validator("fill")
+    def fill_excludes_max_points(cls, v, values, **kwargs):
+        if v is not None and values.get("max_points") is not None:
+            raise ValueError("`fill` can't be combined with `max_points`")
+        return v
+
+
+class RollingWeatherQuery(BaseModel):
+
+    after: datetime
+    before: datetime
+    window: timedelta
+    step: timedelta
+    aggregate: Literal["mean", "sum"] = "mean"
+    station_id: str | None = None
+    tz_offset: timedelta = timedelta(seconds=0)
+    kind: Literal["rolling"] = "rolling"
+
+    @validator("before")
+    def before_must_be_later(cls, v, values, **kwargs):
+        if not v > values["after"]:
+            raise ValueError("`before` must be greater than `after`")
+        return v
+
+    @validator("window", "step")
+    def must_be_positive(cls, v, **kwargs):
+        if not v.total_seconds() >= 1:
+            raise ValueError("`window` and `step` must be at least one second")
+        return v
+
+    @validator("step")
+    def step_must_not_exceed_max_buckets(cls, v, values, **kwargs):
+        _check_buckets(values, v, "step")
+        return v
+
+
+class ExportWeatherQuery(BaseModel):
+
+    after: datetime
+    before: datetime
+    station_id: str | None = None
+    kind: Literal["export"] = "export"
+
+    @validator("before")
+    def before_must_be_later(cls, v, values, **kwargs):
+        if not v > values["after"]:
+            raise ValueError("`before` must be greater than `after`")
+        return v
+
+
+class PercentileWeatherQuery(BaseModel):
+    """Percentiles (0 to 100) per channel, per UTC day, calendar month or for
+    the whole range; ranges are extended to whole days"""
+
+    after: datetime
+    before: datetime
+    channels: list[str] = ["external_temperature_c", "relative_humidity_perc"]
+    percentiles: list[float] = [5, 50, 95]
+    period: Literal["day", "month", "total"] = "day"
+    station_id: str | None = None
+    kind: Literal["percentiles"] = "percentiles"
+
+    @validator("before")
+    def before_must_be_later(cls, v, values, **kwargs):
+        if not v > values["after"]:
+            raise ValueError("`before` must be greater than `after`")
+        return v
+
+    @validator("channels")
+    def channels_must_exist(cls, v, **kwargs):
+        unknown = set(v) - set(CHANNELS)
+        if unknown:
+            raise ValueError(f"Unknown channels: {', '.join(sorted(unknown))}")
+        return v
+
+    @validator("percentiles")
+    def percentiles_must_be_in_range(cls, v, **kwargs):
+        if not all(0 <= p <= 100 for p in v):
+            raise ValueError("`percentiles` must be between 0 and 100")
+        return v
+
+
+class RetentionPolicy(BaseModel):
+    """Raw data older than `max_age` is downsampled to buckets of `interval`;
+    this is done in transactions covering `batch` of raw data each"""
+
+    max_age: timedelta = timedelta(days=365)
+    interval: timedelta = timedelta(hours=1)
+    batch: timedelta = timedelta(days=1)
+
+
+WeatherQuery = (
+    LatestWeatherQuery
+    | AverageWeatherQuery
+    | TimeSeriesWeatherQuery
+    | RollingWeatherQuery
+)
+
 
 class WeatherInteractor:
     """Responsible for business logic; pretty thin, since most is pushed to DB"""
@@ -71,20 +270,106 @@ class WeatherInteractor:
     def __init__(self, weather_db_gateway: WeatherDbGateway) -> None:
         self._weather_db_gateway = weather_db_gateway
 
-    def load(self, data: Iterable[WeatherData]) -> None:
+    def load(self, data: Iterable[WeatherData] | WeatherBatch) -> None:
         self._weather_db_gateway.load(data)
 
-    def get(
-        self, query: LatestWeatherQuery | AverageWeatherQuery | TimeSeriesWeatherQuery
-    ) -> list[WeatherData]:
+    def stream(
+        self, query: TimeSeriesWeatherQuery, chunk_size: int = 1000
+    ) -> Iterator[WeatherData]:
+        """Streams the buckets of a timeseries query, without materializing them
+        all at once"""
+        return self._weather_db_gateway.iter_between(
+            query.after,
+            query.before,
+            query.interval,
+            station_id=query.station_id,
+            tz=timezone(query.tz_offset),
+            chunk_size=chunk_size,
+        )
+
+    def export(
+        self, query: ExportWeatherQuery, batch_size: int = 10000
+    ) -> Iterator[dict[str, list[Any]]]:
+        """Streams all stored data in the range as columnar batches"""
+        return self._weather_db_gateway.iter_columns(
+            query.after,
+            query.before,
+            station_id=query.station_id,
+            batch_size=batch_size,
+        )
+
+    def apply_retention(
+        self, policy: RetentionPolicy, now: datetime | None = None
+    ) -> int:
+        now = now or datetime.now(timezone.utc)
+        return self._weather_db_gateway.compact(
+            now - policy.max_age, policy.interval, policy.batch
+        )
+
+    def get_percentiles(
+        self, query: PercentileWeatherQuery
+    ) -> list[WeatherPercentiles]:
+        """Merges the daily sketches of each channel per period"""
+        merged: dict[tuple[datetime, str], TDigest] = {}
+        for day, channel, digest in self._weather_db_gateway.iter_sketches(
+            query.after,
+            query.before,
+            channels=query.channels,
+            station_id=query.station_id,
+        ):
+            if query.period == "day":
+                start = day
+            elif query.period == "month":
+                start = day.replace(day=1)
+            else:
+                start = query.after
+            if (start, channel) in merged:
+                merged[start, channel].merge(digest)
+            else:
+                merged[start, channel] = digest
+        return [
+            WeatherPercentiles(
+                timestamp=start,
+                channel=channel,
+                count=int(digest.count),
+                values=[digest.quantile(p / 100) for p in query.percentiles],
+            )
+            for (start, channel), digest in merged.items()
+        ]
+
+    def rebuild_sketches(self) -> int:
+        return self._weather_db_gateway.rebuild_sketches()
+
+    def rename_station(self, old: str, new: str) -> int:
+        return self._weather_db_gateway.rename_station(old, new)
+
+    def delete_station(self, station_id: str) -> int:
+        return self._weather_db_gateway.delete_station(station_id)
+
+    def get(self, query: WeatherQuery) -> list[WeatherData]:
         tz = timezone(query.tz_offset)
+        station_id = query.station_id
         if query.kind == "latest":
-            return [self._weather_db_gateway.get_latest(tz=tz)]
+            return [self._weather_db_gateway.get_latest(station_id=station_id, tz=tz)]
         elif query.kind == "average":
-            return [self._weather_db_gateway.get_average_since(query.after, tz=tz)]
+            return [
+                self._weather_db_gateway.get_average_since(
+                    query.after, station_id=station_id, tz=tz
+                )
+            ]
         elif query.kind == "timeseries":
             return self._weather_db_gateway.get_between(
-                query.after, query.before, query.interval, tz=tz
+                query.after, query.before, query.interval, station_id=station_id, tz=tz
+            )
+        elif query.kind == "rolling":
+            return self._weather_db_gateway.get_rolling(
+                query.after,
+                query.before,
+                query.window,
+                query.step,
+                aggregate=query.aggregate,
+                station_id=station_id,
+                tz=tz,
             )
 
 
@@ -1,14 +1,20 @@
 """Responsible for instantiating and tying everything together to run as ASGI webapp"""
 
+import asyncio
+import json
+import logging
 import os
 from datetime import datetime, timedelta
-from typing import Annotated
+from typing import Annotated, Any, Iterable, Iterator, Literal
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import (
     OAuth2PasswordBearer,
     OAuth2PasswordRequestForm,
 )
+from pydantic import ValidationError
 
 from .adapters import (
     RawWeatherData,
@@ -16,18 +22,46 @@ from .adapters import (
 )
 from .drivers import SQLiteConnection
 from .entities import Scope
-from .exceptions import AuthorizationError, DatabaseIntegrityError
+from .exceptions import (
+    AuthorizationError,
+    DatabaseIntegrityError,
+    DataNotFoundError,
+    UnsupportedFormatError,
+)
+from .exporters import MEDIA_TYPES, ExportFormat
 from .gateways import SQLConnection, SQLWeatherDbGateway
 from .interactors import (
     AverageWeatherQuery,
     CheckPermissionInteractor,
     CreateTokenInteractor,
+    ExportWeatherQuery,
     LatestWeatherQuery,
+    PercentileWeatherQuery,
+    RetentionPolicy,
+    RollingWeatherQuery,
     TimeSeriesWeatherQuery,
     WeatherInteractor,
 )
+from .middleware import CompressionMiddleware, ProfilingMiddleware
+from .migrations import SQLMigrator
+from .profiling import ProfileStore, phase
+from .responses import WeatherJSONResponse
 
 DB_PATH = os.getenv("DB_URL", "./data/db.sqlite")
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSION_LEVEL = os.getenv("COMPRESSION_LEVEL")
+# Retention is only applied by the app if a maximum age is configured
+RETENTION_MAX_AGE_DAYS = os.getenv("RETENTION_MAX_AGE_DAYS")
+RETENTION_PERIOD_SECONDS = int(os.getenv("RETENTION_PERIOD_SECONDS", "86400"))
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "1000"))
+# Long timeseries queries are split over this many connections (1 disables it)
+QUERY_PARALLELISM = int(os.getenv("QUERY_PARALLELISM", "1"))
+QUERY_SPLIT_THRESHOLD_DAYS = float(os.getenv("QUERY_SPLIT_THRESHOLD_DAYS", "90"))
+# Requests can only be profiled if a directory to store profiles is configured
+PROFILING_DIR = os.getenv("PROFILING_DIR")
+PROFILING_RETENTION = int(os.getenv("PROFILING_RETENTION", "20"))
+
+logger = logging.getLogger(__name__)
 
 
 oauth2_scheme = OAuth2PasswordBearer(
@@ -39,6 +73,26 @@ oauth2_scheme = OAuth2PasswordBearer(
 )
 
 app = FastAPI(title="Greenhouse climate API")
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    level=int(COMPRESSION_LEVEL) if COMPRESSION_LEVEL else None,
+)
+
+
+def _can_profile(token: str) -> bool:
+    try:
+        CheckPermissionInteractor().check_write_access(token)
+    except AuthorizationError:
+        return False
+    return True
+
+
+profile_store = (
+    ProfileStore(PROFILING_DIR, PROFILING_RETENTION) if PROFILING_DIR else None
+)
+if profile_store is not None:
+    app.add_middleware(ProfilingMiddleware, store=profile_store, authorize=_can_profile)
 
 
 def sql_connection() -> SQLiteConnection:
@@ -47,10 +101,59 @@ def sql_connection() -> SQLiteConnection:
     return SQLiteConnection(DB_PATH)
 
 
+@app.on_event("startup")
+def migrate_database():
+    conn = sql_connection()
+    try:
+        version = SQLMigrator(conn).migrate()
+        logger.info("Database schema at version %d", version)
+    finally:
+        conn.close()
+
+
+def apply_retention(policy: RetentionPolicy) -> int:
+    conn = sql_connection()
+    try:
+        return WeatherInteractor(SQLWeatherDbGateway(conn)).apply_retention(policy)
+    finally:
+        conn.close()
+
+
+async def apply_retention_periodically(policy: RetentionPolicy):
+    while True:
+        try:
+            removed = await run_in_threadpool(apply_retention, policy)
+            logger.info("Compacted %d rows", removed)
+        except Exception:
+            logger.exception("Failed to apply retention policy")
+        await asyncio.sleep(RETENTION_PERIOD_SECONDS)
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+@app.on_event("startup")
+async def schedule_retention():
+    if not RETENTION_MAX_AGE_DAYS:
+        return
+    policy = RetentionPolicy(max_age=timedelta(days=int(RETENTION_MAX_AGE_DAYS)))
+    task = asyncio.create_task(apply_retention_periodically(policy))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 def interactor(
     conn: SQLConnection = Depends(sql_connection),
 ) -> WebAppWeatherAdapter:
-    gateway = SQLWeatherDbGateway(conn)
+    # Parallel queries connect to the same database as `conn`, so they also
+    # follow overrides of `sql_connection`
+    connect = conn.reopen if isinstance(conn, SQLiteConnection) else None
+    gateway = SQLWeatherDbGateway(
+        conn,
+        connect=connect,
+        parallelism=QUERY_PARALLELISM,
+        split_threshold=timedelta(days=QUERY_SPLIT_THRESHOLD_DAYS),
+    )
     interactor = WeatherInteractor(gateway)
     adapted_interactor = WebAppWeatherAdapter(interactor)
     return adapted_interactor
@@ -58,7 +161,8 @@ def interactor(
 
 def read_access(token: Annotated[str, Depends(oauth2_scheme)]):
     try:
-        CheckPermissionInteractor().check_read_access(token)
+        with phase("auth"):
+            CheckPermissionInteractor().check_read_access(token)
     except AuthorizationError as err:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -69,7 +173,8 @@ def read_access(token: Annotated[str, Depends(oauth2_scheme)]):
 
 def write_access(token: Annotated[str, Depends(oauth2_scheme)]):
     try:
-        CheckPermissionInteractor().check_write_access(token)
+        with phase("auth"):
+            CheckPermissionInteractor().check_write_access(token)
     except AuthorizationError as err:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -107,6 +212,7 @@ def post_weather(
     ```json
     [
         {
+            "name": "greenhouse-1",
             "ts": "2023-01-01T00:00:00+00:00"
             "rows": [
                 ["external_temperature_c", 1.23],
@@ -132,16 +238,26 @@ def post_weather(
     ]
     ```
 
-    Other fields or keys will be ignored.
+    The `name` identifies the station the data comes from; if omitted, the
+    data is stored for station `default`. Other fields or keys will be ignored.
+    The body may be compressed, in which case `Content-Encoding` should be set
+    to `gzip` or `zstd`.
     """
     try:
         interactor.load(payload)
     except DatabaseIntegrityError as err:
+        if "compacted" in str(err):
+            raise HTTPException(
+                409, "Can't upload data for a period that was already compacted"
+            ) from err
         raise HTTPException(409, "Can't upload the same timestamp twice") from err
+    except ValueError as err:
+        raise HTTPException(422, str(err)) from err
 
 
 @app.get("/weather/latest", dependencies=[Depends(read_access)])
 def get_weather_latest(
+    station_id: str | None = None,
     tz_offset_seconds: timedelta = timedelta(seconds=0),
     interactor: WebAppWeatherAdapter = Depends(interactor),
 ):
@@ -149,15 +265,20 @@ def get_weather_latest(
     Get latest weather data
 
     Parameters:
+    - **station_id**: station to get data for; latest of any station if omitted
     - **tz_offset_seconds**: timezone for presented output
     """
-    query = LatestWeatherQuery(tz_offset=tz_offset_seconds)
-    return interactor.get(query)
+    query = LatestWeatherQuery(station_id=station_id, tz_offset=tz_offset_seconds)
+    try:
+        return _json(interactor.get(query))
+    except DataNotFoundError as err:
+        raise HTTPException(404, str(err)) from err
 
 
 @app.get("/weather/average", dependencies=[Depends(read_access)])
 def get_weather_average(
     after: datetime,
+    station_id: str | None = None,
     tz_offset_seconds: timedelta = timedelta(seconds=0),
     interactor: WebAppWeatherAdapter = Depends(interactor),
 ):
@@ -166,10 +287,16 @@ def get_weather_average(
 
     Parameters:
     - **after**: start of average
+    - **station_id**: station to get data for; averaged over all if omitted
     - **tz_offset_seconds**: timezone for presented output
     """
-    query = AverageWeatherQuery(after=after, tz_offset=tz_offset_seconds)
-    return interactor.get(query)
+    query = AverageWeatherQuery(
+        after=after, station_id=station_id, tz_offset=tz_offset_seconds
+    )
+    try:
+        return _json(interactor.get(query))
+    except DataNotFoundError as err:
+        raise HTTPException(404, str(err)) from err
 
 
 @app.get("/weather/timeseries", dependencies=[Depends(read_access)])
@@ -177,7 +304,11 @@ def get_weather_timeseries(
     after: datetime,
     before: datetime,
     interval_seconds: timedelta,
+    station_id: str | None = None,
     tz_offset_seconds: timedelta = timedelta(seconds=0),
+    max_points: int | None = Query(None, ge=3),
+    fill: Literal["null", "ffill", "linear"] | None = None,
+    stream: bool = False,
     interactor: WebAppWeatherAdapter = Depends(interactor),
 ):
     """
@@ -186,13 +317,225 @@ def get_weather_timeseries(
     Parameters:
     - **after**: start of time series
     - **before**: end of time series
-    - **interval_seconds**: bucket size
+    - **interval_seconds**: bucket size; a whole number of seconds, at least 1.
+      The range may hold at most 200000 buckets.
+    - **station_id**: station to get data for; averaged over all if omitted
     - **tz_offset_seconds**: timezone for presented output
+    - **max_points**: if given, each field is downsampled to at most this many
+      points, by keeping the minimum and maximum of `max_points / 2` equal
+      buckets from `after` to `before`, which preserves peaks. The output then
+      holds a `{"timestamp": [...], "value": [...]}` object per field, since
+      each field keeps its own points.
+    - **fill**: if given, returns a dense grid with a bucket every interval
+      from `after` to `before`; empty buckets are filled with `null`, the
+      previous value (`ffill`) or interpolated (`linear`). Can't be combined
+      with `max_points`.
+
+    - **stream**: if true, the timeseries is streamed as newline-delimited
+      JSON; each line holds the same structure as the regular output for the
+      next chunk of buckets. Keeps memory bounded for long ranges. Can't be
+      combined with `max_points` or `fill`.
+
+    Buckets are aligned to the local time of `tz_offset_seconds`, so daily
+    buckets start at local midnight.
+    """
+    try:
+        query = TimeSeriesWeatherQuery(
+            after=after,
+            before=before,
+            interval=interval_seconds,
+            station_id=station_id,
+            tz_offset=tz_offset_seconds,
+            max_points=max_points,
+            fill=fill,
+        )
+    except ValidationError as err:
+        raise HTTPException(422, str(err)) from err
+    if stream:
+        if max_points is not None or fill is not None:
+            raise HTTPException(
+                422, "`stream` can't be combined with `max_points` or `fill`"
+            )
+        return StreamingResponse(
+            _ndjson(interactor.stream(query, chunk_size=STREAM_CHUNK_SIZE)),
+            media_type="application/x-ndjson",
+        )
+    return _json(interactor.get(query))
+
+
+def _json(content: Any) -> WeatherJSONResponse:
+    """Encodes the response right away, so it can be profiled, and doesn't
+    block the event loop; skips FastAPI's `jsonable_encoder`"""
+    with phase("encode"):
+        return WeatherJSONResponse(content)
+
+
+def _ndjson(chunks: Iterable[dict[str, list]]) -> Iterator[bytes]:
+    for chunk in chunks:
+        with phase("encode"):
+            line = json.dumps(chunk, default=_json_default, separators=(",", ":"))
+        yield line.encode()
+        yield b"\n"
+
+
+def _json_default(obj: Any) -> str:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+@app.get("/weather/rolling", dependencies=[Depends(read_access)])
+def get_weather_rolling(
+    after: datetime,
+    before: datetime,
+    window_seconds: timedelta,
+    step_seconds: timedelta,
+    aggregate: Literal["mean", "sum"] = "mean",
+    station_id: str | None = None,
+    tz_offset_seconds: timedelta = timedelta(seconds=0),
+    interactor: WebAppWeatherAdapter = Depends(interactor),
+):
+    """
+    Rolling-window aggregate over weather data
+
+    For every step, the aggregate over the window ending at the last sample in
+    that step is returned; e.g. a 24h rolling mean at 5 minute resolution.
+
+    Parameters:
+    - **after**: start of time series
+    - **before**: end of time series
+    - **window_seconds**: size of the rolling window
+    - **step_seconds**: resolution of the output
+    - **aggregate**: `mean` or `sum`
+    - **station_id**: station to get data for; aggregated over all if omitted
+    - **tz_offset_seconds**: timezone for presented output
+    """
+    try:
+        query = RollingWeatherQuery(
+            after=after,
+            before=before,
+            window=window_seconds,
+            step=step_seconds,
+            aggregate=aggregate,
+            station_id=station_id,
+            tz_offset=tz_offset_seconds,
+        )
+    except ValidationError as err:
+        raise HTTPException(422, str(err)) from err
+    return _json(interactor.get(query))
+
+
+@app.get("/weather/percentiles", dependencies=[Depends(read_access)])
+def get_weather_percentiles(
+    after: datetime,
+    before: datetime,
+    channel: list[str] | None = Query(None),
+    percentile: list[float] | None = Query(None),
+    period: Literal["day", "month", "total"] = "day",
+    station_id: str | None = None,
+    interactor: WebAppWeatherAdapter = Depends(interactor),
+):
+    """
+    Percentiles of weather data per day, month or over the whole range
+
+    Percentiles are estimated from t-digest sketches, kept per station, UTC
+    day and channel. The true rank of an estimated q-th percentile lies within
+    `2π·sqrt(q·(1 − q)) / 100` of q (e.g. ±1.4 percentage points for the 5th
+    and 95th percentile, and ±3.1 for the median); in practice the error is
+    much smaller. Days and months are in UTC, and the range is extended to
+    whole days.
+
+    Parameters:
+    - **after**: start of range
+    - **before**: end of range
+    - **channel**: channels to get percentiles for; may be repeated (default
+      `external_temperature_c` and `relative_humidity_perc`)
+    - **percentile**: percentiles from 0 to 100; may be repeated (default 5,
+      50 and 95)
+    - **period**: `day`, `month` or `total`
+    - **station_id**: station to get data for; over all stations if omitted
+
+    The output holds the start of every period (`timestamp`), the number of
+    samples per period (`count`), and per channel a column per percentile.
+    """
+    kwargs: dict[str, Any] = {}
+    if channel:
+        kwargs["channels"] = channel
+    if percentile:
+        kwargs["percentiles"] = percentile
+    try:
+        query = PercentileWeatherQuery(
+            after=after, before=before, period=period, station_id=station_id, **kwargs
+        )
+    except ValidationError as err:
+        raise HTTPException(422, str(err)) from err
+    return _json(interactor.get_percentiles(query))
+
+
+@app.get("/weather/export", dependencies=[Depends(read_access)])
+def get_weather_export(
+    after: datetime,
+    before: datetime,
+    station_id: str | None = None,
+    format: ExportFormat = "csv",
+    interactor: WebAppWeatherAdapter = Depends(interactor),
+):
+    """
+    Export stored data as a file, for bulk analysis
+
+    Raw data is exported as is; compacted data has `samples` > 1. Parquet files
+    hold one row group per (UTC) day.
+
+    Parameters:
+    - **after**: start of range
+    - **before**: end of range
+    - **station_id**: station to export; all stations if omitted
+    - **format**: `csv` (default), `parquet` or `arrow` (IPC stream); the
+      latter two require the `parquet` extra
+    """
+    try:
+        query = ExportWeatherQuery(after=after, before=before, station_id=station_id)
+        content = interactor.export(query, format)
+    except ValidationError as err:
+        raise HTTPException(422, str(err)) from err
+    except UnsupportedFormatError as err:
+        raise HTTPException(400, str(err)) from err
+    return StreamingResponse(
+        content,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="weather.{format}"'},
+    )
+
+
+def _profile_path(profile_id: str, kind: str) -> str:
+    path = profile_store.path(profile_id, kind) if profile_store else None
+    if path is None:
+        raise HTTPException(404, "Profile not found")
+    return path
+
+
+@app.get("/profiles/{profile_id}", dependencies=[Depends(write_access)])
+def get_profile(profile_id: str):
+    """
+    Summary of a profiled request
+
+    Requests are profiled if profiling is enabled (`PROFILING_DIR` is set),
+    and they are sent with an `X-Profile: 1` header and a token with write
+    access; the id of the profile is returned in the `X-Profile-Id` header.
+    The summary holds the time spent per phase (`auth`, `sql`,
+    `row_to_weather`, `pivot` and `encode`), excluding nested phases.
+    """
+    return FileResponse(_profile_path(profile_id, "json"))
+
+
+@app.get("/profiles/{profile_id}/pstats", dependencies=[Depends(write_access)])
+def get_profile_stats(profile_id: str):
+    """
+    cProfile statistics of a profiled request, covering the code that ran in
+    its phases; open with e.g. `python -m pstats` or `snakeviz`
     """
-    query = TimeSeriesWeatherQuery(
-        after=after,
-        before=before,
-        interval=interval_seconds,
-        tz_offset=tz_offset_seconds,
+    return FileResponse(
+        _profile_path(profile_id, "pstats"),
+        media_type="application/octet-stream",
+        filename=f"{profile_id}.pstats",
     )
-    return interactor.get(query)
@@ -0,0 +1,291 @@
+"""ASGI middleware used by the webapp"""
+
+import zlib
+from typing import Any, Callable, Protocol
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .profiling import Profile, ProfileStore
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstd support is optional
+    zstandard = None  # type: ignore[assignment]
+
+
+class _Compressor(Protocol):
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    def flush(self) -> bytes:
+        ...
+
+
+def _gzip_compressor(level: int) -> _Compressor:
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def _zstd_compressor(level: int) -> _Compressor:
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+
+# A zstd block of a few bytes can expand to 128 KiB, so input is fed in small
+# chunks; output then can't overshoot the limit by more than a few MiB
+_ZSTD_CHUNK_SIZE = 128
+
+
+def _zstd_decompress(body: bytes, max_size: int) -> bytes:
+    # Streaming decompression, since frames don't always carry a content size.
+    # A body may hold multiple frames; a decompressor handles only one.
+    out = bytearray()
+    while body:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        for i in range(0, len(body), _ZSTD_CHUNK_SIZE):
+            out += decompressor.decompress(body[i : i + _ZSTD_CHUNK_SIZE])
+            if len(out) > max_size:
+                raise ValueError("Decompressed body too large")
+            if decompressor.eof:
+                body = decompressor.unused_data + body[i + _ZSTD_CHUNK_SIZE :]
+                break
+        else:
+            raise ValueError("Truncated body")
+    return bytes(out)
+
+
+def _gzip_decompress(body: bytes, max_size: int) -> bytes:
+    # A body may hold multiple gzip members; a decompressor handles only one
+    out = bytearray()
+    while body:
+        decompressor = zlib.decompressobj(31)
+        out += decompressor.decompress(body, max_size + 1 - len(out))
+        if len(out) > max_size:
+            raise ValueError("Decompressed body too large")
+        if not decompressor.eof:
+            raise ValueError("Truncated body")
+        body = decompressor.unused_data
+    return bytes(out)
+
+
+_COMPRESSORS: dict[str, Callable[[int], _Compressor]] = {"gzip": _gzip_compressor}
+_DECOMPRESSORS: dict[str, Callable[[bytes, int], bytes]] = {"gzip": _gzip_decompress}
+if zstandard is not None:
+    _COMPRESSORS["zstd"] = _zstd_compressor
+    _DECOMPRESSORS["zstd"] = _zstd_decompress
+
+_DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+class CompressionMiddleware:
+    """Transparently handles compressed request and response bodies
+
+    Request bodies sent with `Content-Encoding: gzip|zstd` are decompressed
+    before they reach the app. Responses of at least `minimum_size` bytes are
+    compressed with the best encoding the client accepts (zstd over gzip).
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        level: int | None = None,
+        max_request_size: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+        self.max_request_size = max_request_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "").lower()
+        if content_encoding in _DECOMPRESSORS:
+            try:
+                scope, receive = await self._decompress_request(
+                    scope, receive, content_encoding
+                )
+            except Exception:
+                await self._reject(send, 400, b"Couldn't decompress request body")
+                return
+        elif content_encoding not in ("", "identity"):
+            await self._reject(send, 415, b"Unsupported Content-Encoding")
+            return
+        encoding = self._negotiate(headers.get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        level = self.level if self.level is not None else _DEFAULT_LEVELS[encoding]
+        responder = _CompressingResponder(
+            send, encoding, _COMPRESSORS[encoding](level), self.minimum_size
+        )
+        await self.app(scope, receive, responder.send)
+
+    async def _decompress_request(
+        self, scope: Scope, receive: Receive, encoding: str
+    ) -> tuple[Scope, Receive]:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = _DECOMPRESSORS[encoding](b"".join(chunks), self.max_request_size)
+        # Drop headers describing the compressed body
+        scope = dict(scope)
+        scope["headers"] = [
+            (key, value)
+            for key, value in scope["headers"]
+            if key not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+        sent = False
+
+        async def wrapped_receive() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        return scope, wrapped_receive
+
+    @staticmethod
+    def _negotiate(accept_encoding: str) -> str | None:
+        accepted: dict[str, float] = {}
+        for part in accept_encoding.split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ("zstd", "gzip"):
+            if accepted.get(encoding, 0.0) > 0 and encoding in _COMPRESSORS:
+                return encoding
+        return None
+
+    @staticmethod
+    async def _reject(send: Send, status: int, detail: bytes) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-length", str(len(detail)).encode())],
+            }
+        )
+        await send({"type": "http.response.body", "body": detail})
+
+
+class _CompressingResponder:
+    """Wraps `send`; compresses the body if it is large enough, streaming if
+    the app streams"""
+
+    def __init__(
+        self, send: Send, encoding: str, compressor: _Compressor, minimum_size: int
+    ) -> None:
+        self._send = send
+        self._encoding = encoding
+        self._compressor = compressor
+        self._minimum_size = minimum_size
+        self._start: dict[str, Any] = {}
+        self._started = False
+        self._passthrough = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self._start = dict(message)
+            headers = Headers(raw=message["headers"])
+            self._passthrough = "content-encoding" in headers
+        elif message["type"] == "http.response.body" and not self._started:
+            self._started = True
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            # Already encoded, or not worth the effort for small bodies
+            if self._passthrough or (not more_body and len(body) < self._minimum_size):
+                self._passthrough = True
+                await self._send(self._start)
+                await self._send(message)
+                return
+            headers = MutableHeaders(raw=self._start["headers"])
+            headers["Content-Encoding"] = self._encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                compressed = self._compressor.compress(body)
+            else:
+                compressed = self._compressor.compress(body)
+                compressed += self._compressor.flush()
+                headers["Content-Length"] = str(len(compressed))
+            self._start["headers"] = headers.raw
+            await self._send(self._start)
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+        elif message["type"] == "http.response.body":
+            if self._passthrough:
+                await self._send(message)
+                return
+            more_body = message.get("more_body", False)
+            compressed = self._compressor.compress(message.get("body", b""))
+            if not more_body:
+                compressed += self._compressor.flush()
+            await self._send(
+                {
+                    "type": "http.response.body",
+                    "body": compressed,
+                    "more_body": more_body,
+                }
+            )
+        else:
+            await self._send(message)
+
+
+class ProfilingMiddleware:
+    """Profiles requests sent with an `X-Profile: 1` header, if `authorize`
+    accepts their bearer token
+
+    The id of the profile is returned in the `X-Profile-Id` header; the profile
+    itself is stored in `store` once the response is sent.
+    """
+
+    def __init__(
+        self, app: ASGIApp, store: ProfileStore, authorize: Callable[[str], bool]
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.authorize = authorize
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._requested(Headers(scope=scope)):
+            await self.app(scope, receive, send)
+            return
+        profile = Profile()
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                headers = MutableHeaders(raw=list(message["headers"]))
+                headers["X-Profile-Id"] = profile.id
+                message["headers"] = headers.raw
+            await send(message)
+
+        with profile.activate():
+            await self.app(scope, receive, send_with_id)
+        await run_in_threadpool(self.store.save, profile)
+
+    def _requested(self, headers: Headers) -> bool:
+        if headers.get("x-profile", "").lower() not in ("1", "true"):
+            return False
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and self.authorize(token)
@@ -0,0 +1,145 @@
+"""Responsible for bringing the database schema up to date"""
+
+import contextlib
+import os
+import sqlite3
+from datetime import timedelta
+from typing import Iterator
+
+from .gateways import SQLConnection
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None  # type: ignore[assignment]
+
+_MIGRATIONS_DIR = "./app/sql/migrations"
+_NO_TRANSACTION = "-- no-transaction"
+
+
+def _load_migrations(directory: str) -> list[tuple[int, str]]:
+    """Migrations are SQL files named `<version>_<description>.sql`"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".sql"):
+            continue
+        version = int(filename.split("_", 1)[0])
+        with open(os.path.join(directory, filename), "r") as f:
+            migrations.append((version, f.read()))
+    return migrations
+
+
+def _split_statements(script: str) -> list[str]:
+    """Splits a script on the semicolons that end a statement; not those in
+    comments, string literals or trigger bodies"""
+    statements = []
+    statement = ""
+    for part in script.split(";"):
+        statement += part + ";"
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ""
+    # The split adds a semicolon to whatever follows the last statement
+    if statement[:-1].strip():
+        statements.append(statement[:-1])
+    return statements
+
+
+class SQLMigrator:
+    """Applies pending migrations; the schema version is tracked in SQLite's
+    `user_version` pragma
+
+    Each migration runs in a single transaction, unless its first line is
+    `-- no-transaction` (e.g. for `VACUUM`, which can't run in a transaction).
+    Processes that migrate the same database file at the same time (e.g. the
+    workers of the app) take turns through a lock file next to it, so each
+    migration runs only once; the others wait for it as long as it takes.
+    Other connections to the database are waited for up to `busy_timeout`.
+    """
+
+    _migrations = _load_migrations(_MIGRATIONS_DIR)
+
+    def __init__(
+        self, conn: SQLConnection, busy_timeout: timedelta = timedelta(minutes=10)
+    ) -> None:
+        self._conn = conn
+        self._busy_timeout_ms = int(busy_timeout.total_seconds() * 1000)
+
+    @property
+    def latest_version(self) -> int:
+        return self._migrations[-1][0]
+
+    def current_version(self) -> int:
+        cur = self._conn.cursor()
+        cur.execute("PRAGMA user_version;")
+        row = cur.fetchone()
+        return row["user_version"] if row else 0
+
+    def migrate(self) -> int:
+        """Applies all pending migrations; returns the resulting version"""
+        cur = self._conn.cursor()
+        cur.execute("PRAGMA busy_timeout;")
+        row = cur.fetchone()
+        previous_timeout = row["timeout"] if row else 0
+        cur.execute(f"PRAGMA busy_timeout = {self._busy_timeout_ms};")
+        # It returns the new timeout; a pending row would block the VACUUM
+        cur.fetchall()
+        try:
+            with self._lock():
+                # Read only once the lock is held, since another process may
+                # have migrated in the meantime
+                current = self.current_version()
+                for version, script in self._migrations:
+                    if version > current:
+                        current = self._apply(version, script)
+                return current
+        finally:
+            cur.execute(f"PRAGMA busy_timeout = {previous_timeout};")
+            cur.fetchall()
+
+    @contextlib.contextmanager
+    def _lock(self) -> Iterator[None]:
+        """Blocks until no other process is migrating the same database"""
+        cur = self._conn.cursor()
+        cur.execute("PRAGMA database_list;")
+        path = next(
+            (row["file"] for row in cur.fetchall() if row["name"] == "main"), ""
+        )
+        if fcntl is None or not path:
+            # In-memory databases can't be shared with other processes; without
+            # fcntl, only the transactions below serialize migrations
+            yield
+            return
+        # A file of its own, since SQLite's locks on the database file itself
+        # are released when any other descriptor of it is closed
+        with open(f"{path}-migrate.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _apply(self, version: int, script: str) -> int:
+        """Applies a migration; returns the resulting version"""
+        cur = self._conn.cursor()
+        statements = _split_statements(script)
+        if script.startswith(_NO_TRANSACTION):
+            for statement in statements:
+                cur.execute(statement)
+            statements = []
+        # Also take the write lock before checking the version again, in case
+        # another process migrates without the lock file
+        cur.execute("BEGIN IMMEDIATE;")
+        try:
+            current = self.current_version()
+            if current >= version:
+                self._conn.rollback()
+                return current
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(f"PRAGMA user_version = {version};")
+        except Exception:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+        return version
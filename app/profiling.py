@@ -0,0 +1,166 @@
+"""Opt-in profiling of individual requests
+
+Code marks the phases of handling a request (e.g. `with phase("sql"): ...`).
+Outside of a profiled request, a phase costs a single context variable lookup.
+Within one, the time spent in each phase is recorded, and everything that runs
+inside a phase is profiled with cProfile, in whichever thread it runs.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import re
+import secrets
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator
+
+_current: ContextVar["Profile | None"] = ContextVar("profile", default=None)
+
+_PROFILE_ID = re.compile(r"^[0-9]+-[0-9a-f]+$")
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Attributes the time spent in the block to `name`, if the current request
+    is being profiled; blocks must not span a `yield` or `await`"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    with profile.phase(name):
+        yield
+
+
+class Profile:
+    """Phase timings and cProfile statistics of a single request
+
+    Phases may nest; the time of a phase excludes that of the phases nested in
+    it, so the phases add up to at most the total.
+    """
+
+    def __init__(self) -> None:
+        self.id = f"{time.time_ns()}-{secrets.token_hex(4)}"
+        self.started = time.time()
+        self.total = 0.0
+        self._self_times: dict[str, float] = defaultdict(float)
+        self._calls: dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profilers: list[cProfile.Profile] = []
+
+    @contextmanager
+    def activate(self) -> Iterator["Profile"]:
+        token = _current.set(self)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total = time.perf_counter() - start
+            _current.reset(token)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        # Per thread: stack of [phase, start, time spent in nested phases]
+        stack: list[list[Any]] | None = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        profiler = None
+        if not stack:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is active (Python >= 3.12 allows only one)
+                profiler = None
+        entry: list[Any] = [name, time.perf_counter(), 0.0]
+        stack.append(entry)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - entry[1]
+            stack.pop()
+            if stack:
+                stack[-1][2] += elapsed
+            if profiler is not None:
+                profiler.disable()
+            with self._lock:
+                self._self_times[name] += elapsed - entry[2]
+                self._calls[name] += 1
+                if profiler is not None:
+                    self._profilers.append(profiler)
+
+    def summary(self) -> dict[str, Any]:
+        with self._lock:
+            phases = {
+                name: {"seconds": seconds, "calls": self._calls[name]}
+                for name, seconds in self._self_times.items()
+            }
+        return {
+            "id": self.id,
+            "started": self.started,
+            "total_seconds": self.total,
+            "phases": phases,
+            "other_seconds": max(
+                self.total - sum(p["seconds"] for p in phases.values()), 0.0
+            ),
+        }
+
+    def stats(self) -> pstats.Stats | None:
+        with self._lock:
+            profilers = list(self._profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+class ProfileStore:
+    """Keeps the `retention` most recent profiles in `directory`; per profile a
+    JSON summary and a pstats file (e.g. for `snakeviz` or `python -m pstats`)"""
+
+    def __init__(self, directory: str, retention: int = 20) -> None:
+        self._directory = directory
+        self._retention = retention
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, profile: Profile) -> None:
+        stats = profile.stats()
+        if stats is not None:
+            stats.dump_stats(self._path(profile.id, "pstats"))
+        with open(self._path(profile.id, "json"), "w") as f:
+            json.dump(profile.summary(), f)
+        self._prune()
+
+    def path(self, profile_id: str, kind: str) -> str | None:
+        """Path of a stored artifact, or None if it doesn't exist"""
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        path = self._path(profile_id, kind)
+        return path if os.path.exists(path) else None
+
+    def _path(self, profile_id: str, kind: str) -> str:
+        return os.path.join(self._directory, f"{profile_id}.{kind}")
+
+    def _prune(self) -> None:
+        # Ids start with the creation time, so they sort chronologically
+        ids = sorted(
+            (
+                filename[: -len(".json")]
+                for filename in os.listdir(self._directory)
+                if filename.endswith(".json")
+            ),
+            key=lambda profile_id: int(profile_id.split("-", 1)[0]),
+        )
+        for profile_id in ids[: max(len(ids) - self._retention, 0)]:
+            for kind in ("json", "pstats"):
+                try:
+                    os.remove(self._path(profile_id, kind))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,101 @@
+"""Column-wise resampling helpers, used to shape timeseries for presentation"""
+
+from typing import Iterable, Literal, Mapping, Sequence
+
+
+def minmax(
+    samples: Iterable[tuple[float, Sequence[float]]],
+    start: float,
+    end: float,
+    buckets: int,
+) -> list[list[tuple[float, float]]]:
+    """Per column, the minimum and maximum of each of `buckets` equal buckets
+    between `start` and `end`, as `(x, y)` points sorted by `x`
+
+    Takes a single pass over `samples`, which are `(x, columns)` pairs sorted
+    by `x`, and keeps only the current extremes; memory is bounded by the
+    number of buckets, not of samples. Unlike averaging, this preserves peaks.
+    A bucket where both extremes are the same sample yields a single point;
+    without samples, the result is empty.
+    """
+    width = (end - start) / buckets or 1.0
+    # Per column: points selected in previous buckets, and the current
+    # bucket's [min x, min y, max x, max y]
+    points: list[list[tuple[float, float]]] = []
+    extremes: list[list[float]] = []
+    current = -1
+    for x, ys in samples:
+        bucket = min(int((x - start) / width), buckets - 1)
+        if bucket != current:
+            for column, extreme in zip(points, extremes, strict=True):
+                _flush(column, extreme)
+            points = points or [[] for _ in ys]
+            extremes = [[x, y, x, y] for y in ys]
+            current = bucket
+            continue
+        for extreme, y in zip(extremes, ys, strict=True):
+            if y < extreme[1]:
+                extreme[0], extreme[1] = x, y
+            elif y > extreme[3]:
+                extreme[2], extreme[3] = x, y
+    for column, extreme in zip(points, extremes, strict=True):
+        _flush(column, extreme)
+    return points
+
+
+def _flush(column: list[tuple[float, float]], extreme: list[float]) -> None:
+    min_x, min_y, max_x, max_y = extreme
+    if min_x == max_x:
+        column.append((min_x, min_y))
+    elif min_x < max_x:
+        column.extend(((min_x, min_y), (max_x, max_y)))
+    else:
+        column.extend(((max_x, max_y), (min_x, min_y)))
+
+
+def aligned_grid(start: int, end: int, step: int, offset: int = 0) -> range:
+    """Timestamps of all bucket starts in [start, end]; buckets are aligned
+    such that `timestamp + offset` is a multiple of `step`"""
+    first = start - (start + offset) % step
+    if first < start:
+        first += step
+    return range(first, end + 1, step)
+
+
+def fill_grid(
+    xs: Sequence[int],
+    columns: Mapping[str, Sequence[float]],
+    grid: Sequence[int],
+    method: Literal["null", "ffill", "linear"],
+) -> dict[str, list[float | None]]:
+    """Reindexes columns sampled at `xs` onto `grid`, filling the gaps
+
+    Both `xs` and `grid` must be sorted. The neighbours of each grid point
+    are looked up once, and then applied to every column.
+    """
+    n = len(xs)
+    # Per grid point: index of the sample at or before it, and whether it's
+    # an exact match
+    previous: list[int] = []
+    exact: list[bool] = []
+    i = 0
+    for g in grid:
+        while i < n and xs[i] <= g:
+            i += 1
+        previous.append(i - 1)
+        exact.append(i > 0 and xs[i - 1] == g)
+    out: dict[str, list[float | None]] = {}
+    for key, ys in columns.items():
+        values: list[float | None] = []
+        for g, p, is_exact in zip(grid, previous, exact, strict=True):
+            if is_exact:
+                values.append(ys[p])
+            elif method == "ffill" and p >= 0:
+                values.append(ys[p])
+            elif method == "linear" and 0 <= p < n - 1:
+                weight = (g - xs[p]) / (xs[p + 1] - xs[p])
+                values.append(ys[p] + weight * (ys[p + 1] - ys[p]))
+            else:
+                values.append(None)
+        out[key] = values
+    return out
@@ -0,0 +1,86 @@
+"""Response classes used by the webapp"""
+
+import json
+import math
+from datetime import datetime
+from typing import Any
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson support is optional
+    orjson = None  # type: ignore[assignment]
+
+# orjson formats floats below 1e-4 or from 1e16 on differently than `json`
+# (e.g. 0.00001 vs 1e-05, 1e16 vs 1e+16)
+_EXACT_MIN = 1e-4
+_EXACT_MAX = 1e16
+
+
+def _may_hold_inexact(values: list) -> bool:
+    """Quick check on a list; False if it surely holds no float that orjson
+    formats differently"""
+    # Zeros are filtered out, they format the same either way
+    present: list[Any] = list(filter(None, values))
+    try:
+        smallest = abs(min(present, key=abs))
+        largest = abs(max(present, key=abs))
+    except TypeError:
+        # Not just numbers, e.g. timestamps or nested content
+        return any(not isinstance(v, (str, datetime)) for v in present)
+    except ValueError:
+        return False  # Nothing but zeros and None
+    # Also true if there is a NaN, which doesn't compare
+    return not _EXACT_MIN <= smallest <= largest < _EXACT_MAX
+
+
+def _exact(content: Any) -> Any:
+    """Copy of `content`, with the floats that orjson formats differently
+    replaced by their `json` rendering"""
+    if isinstance(content, dict):
+        return {key: _exact(value) for key, value in content.items()}
+    if isinstance(content, list):
+        if not _may_hold_inexact(content):
+            return content
+        return [_exact(value) for value in content]
+    if (
+        type(content) is float
+        and content
+        and math.isfinite(content)
+        and not _EXACT_MIN <= abs(content) < _EXACT_MAX
+    ):
+        return orjson.Fragment(repr(content).encode())
+    return content
+
+
+def _default(obj: Any) -> str:
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class WeatherJSONResponse(JSONResponse):
+    """Renders exactly what FastAPI's default response would after running
+    `jsonable_encoder`, but without converting the content first
+
+    Content may hold JSON types and datetimes. Uses orjson if it is installed;
+    the few floats it formats differently are passed to it preformatted, so
+    the content is only encoded once.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(
+                _exact(content),
+                default=_default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        return json.dumps(
+            content,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+            default=_default,
+        ).encode("utf-8")
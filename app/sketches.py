@@ -0,0 +1,140 @@
+"""Mergeable quantile sketches, used to answer percentile queries without
+sorting all raw data"""
+
+import math
+import sys
+from array import array
+from typing import Iterable
+
+DEFAULT_COMPRESSION = 100.0
+
+
+class TDigest:
+    """Merging t-digest (Dunning & Ertl, "Computing extremely accurate
+    quantiles using t-digests")
+
+    Values are summarized by centroids (mean, weight). The `k1` scale function
+    keeps centroids small near the tails and limits how much of the rank range
+    a single centroid covers: at quantile q at most
+
+        2π·sqrt(q·(1 − q)) / compression
+
+    Since estimates are interpolated within that range, the true rank of an
+    estimated q-quantile lies within that bound of q; e.g. ±1.4 percentage
+    points for the 5th/95th and ±3.1 for the 50th percentile at the default
+    compression of 100. In practice the error is a lot smaller. The bound
+    also holds for merged digests, since merging re-applies the same limit.
+    Minimum and maximum are kept exactly.
+    """
+
+    __slots__ = ("compression", "_means", "_weights", "_buffer", "_min", "_max")
+
+    def __init__(self, compression: float = DEFAULT_COMPRESSION) -> None:
+        self.compression = compression
+        self._means: list[float] = []
+        self._weights: list[float] = []
+        self._buffer: list[float] = []
+        self._min = math.inf
+        self._max = -math.inf
+
+    @property
+    def count(self) -> float:
+        return sum(self._weights) + len(self._buffer)
+
+    def add(self, values: Iterable[float]) -> None:
+        self._buffer.extend(values)
+        if len(self._buffer) > 10 * self.compression:
+            self._compress()
+
+    def merge(self, other: "TDigest") -> None:
+        other._compress()
+        self._compress([*zip(other._means, other._weights, strict=True)])
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+
+    def quantile(self, q: float) -> float | None:
+        """Estimated value at quantile `q` (0 to 1); None if empty"""
+        self._compress()
+        if not self._means:
+            return None
+        total = sum(self._weights)
+        # Piecewise linear through the centroid centers, anchored at the extremes
+        ranks = [0.0]
+        values = [self._min]
+        cumulative = 0.0
+        for mean, weight in zip(self._means, self._weights, strict=True):
+            ranks.append(cumulative + weight / 2)
+            values.append(mean)
+            cumulative += weight
+        ranks.append(total)
+        values.append(self._max)
+        target = q * total
+        for i in range(1, len(ranks)):
+            if target <= ranks[i]:
+                span = ranks[i] - ranks[i - 1]
+                if span <= 0:
+                    return values[i]
+                weight = (target - ranks[i - 1]) / span
+                return values[i - 1] + weight * (values[i] - values[i - 1])
+        return self._max
+
+    def to_bytes(self) -> bytes:
+        self._compress()
+        data = array("d", [self.compression, self._min, self._max])
+        data.extend(self._means)
+        data.extend(self._weights)
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "TDigest":
+        data = array("d")
+        data.frombytes(blob)
+        if sys.byteorder == "big":
+            data.byteswap()
+        digest = cls(data[0])
+        digest._min, digest._max = data[1], data[2]
+        n = (len(data) - 3) // 2
+        digest._means = data[3 : 3 + n].tolist()
+        digest._weights = data[3 + n :].tolist()
+        return digest
+
+    def _k(self, q: float) -> float:
+        return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+    def _compress(self, extra: list[tuple[float, float]] | None = None) -> None:
+        if not self._buffer and not extra:
+            return
+        if self._buffer:
+            self._min = min(self._min, min(self._buffer))
+            self._max = max(self._max, max(self._buffer))
+        centroids = sorted(
+            [
+                *zip(self._means, self._weights, strict=True),
+                *((value, 1.0) for value in self._buffer),
+                *(extra or []),
+            ]
+        )
+        self._buffer = []
+        total = sum(weight for _, weight in centroids)
+        means: list[float] = []
+        weights: list[float] = []
+        mean, weight = centroids[0]
+        before = 0.0  # Weight of all centroids before the current one
+        k_left = self._k(0.0)
+        for next_mean, next_weight in centroids[1:]:
+            q_right = (before + weight + next_weight) / total
+            if self._k(min(q_right, 1.0)) - k_left <= 1:
+                weight += next_weight
+                mean += (next_mean - mean) * next_weight / weight
+            else:
+                means.append(mean)
+                weights.append(weight)
+                before += weight
+                k_left = self._k(min(before / total, 1.0))
+                mean, weight = next_mean, next_weight
+        means.append(mean)
+        weights.append(weight)
+        self._means = means
+        self._weights = weights
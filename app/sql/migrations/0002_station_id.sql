@@ -0,0 +1,83 @@
+-- Add the station as dimension, and cluster data by (station, timestamp):
+-- WITHOUT ROWID tables store rows in primary key order, so reads for a single
+-- station are a contiguous range, without a separate primary key index or an
+-- extra lookup per row. Existing data is assigned to station 'default', since
+-- its station wasn't stored. Run `source_weather_cli rename-station default
+-- <name>` to move it to the name the station uploads its data with.
+CREATE TABLE weather_new (
+    station_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    external_temperature_c REAL NOT NULL,
+    wind_speed_unmuted_m_s REAL NOT NULL,
+    wind_speed_m_s REAL NOT NULL,
+    wind_direction_degrees REAL NOT NULL,
+    radiation_intensity_unmuted_w_m2 REAL NOT NULL,
+    radiation_intensity_w_m2 REAL NOT NULL,
+    standard_radiation_intensity_w_m2 REAL NOT NULL,
+    radiation_sum_j_cm2 REAL NOT NULL,
+    radiation_from_plant_w_m2 REAL NOT NULL,
+    precipitation REAL NOT NULL,
+    relative_humidity_perc REAL NOT NULL,
+    moisture_deficit_g_kg REAL NOT NULL,
+    moisture_deficit_g_m3 REAL NOT NULL,
+    dew_point_temperature_c REAL NOT NULL,
+    abs_humidity_g_kg REAL NOT NULL,
+    enthalpy_kj_kg REAL NOT NULL,
+    enthalpy_kj_m3 REAL NOT NULL,
+    atmospheric_pressure_hpa REAL NOT NULL,
+    PRIMARY KEY (station_id, timestamp)
+) WITHOUT ROWID;
+
+CREATE TABLE weather_compacted_new (
+    station_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    external_temperature_c REAL NOT NULL,
+    wind_speed_unmuted_m_s REAL NOT NULL,
+    wind_speed_m_s REAL NOT NULL,
+    wind_direction_degrees REAL NOT NULL,
+    radiation_intensity_unmuted_w_m2 REAL NOT NULL,
+    radiation_intensity_w_m2 REAL NOT NULL,
+    standard_radiation_intensity_w_m2 REAL NOT NULL,
+    radiation_sum_j_cm2 REAL NOT NULL,
+    radiation_from_plant_w_m2 REAL NOT NULL,
+    precipitation REAL NOT NULL,
+    relative_humidity_perc REAL NOT NULL,
+    moisture_deficit_g_kg REAL NOT NULL,
+    moisture_deficit_g_m3 REAL NOT NULL,
+    dew_point_temperature_c REAL NOT NULL,
+    abs_humidity_g_kg REAL NOT NULL,
+    enthalpy_kj_kg REAL NOT NULL,
+    enthalpy_kj_m3 REAL NOT NULL,
+    atmospheric_pressure_hpa REAL NOT NULL,
+    samples INT NOT NULL,
+    PRIMARY KEY (station_id, timestamp)
+) WITHOUT ROWID;
+
+INSERT INTO weather_new SELECT 'default', * FROM weather ORDER BY timestamp;
+DROP TABLE weather;
+ALTER TABLE weather_new RENAME TO weather;
+
+INSERT INTO weather_compacted_new SELECT 'default', * FROM weather_compacted ORDER BY timestamp;
+DROP TABLE weather_compacted;
+ALTER TABLE weather_compacted_new RENAME TO weather_compacted;
+
+-- For queries across stations
+CREATE INDEX weather_timestamp ON weather (timestamp);
+CREATE INDEX weather_compacted_timestamp ON weather_compacted (timestamp);
+
+-- Compaction removes raw rows, so a raw row posted again after compaction
+-- can't be told apart from new data, and would be counted twice. Keep track
+-- of how far compaction got, and refuse raw rows from before that point. All
+-- buckets have the same size, which is needed to find the bucket a point in
+-- time is in.
+CREATE TABLE weather_compaction (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    before INTEGER NOT NULL,
+    interval_seconds INTEGER NOT NULL
+);
+
+CREATE TRIGGER weather_insert_compacted BEFORE INSERT ON weather
+WHEN NEW.timestamp < (SELECT before FROM weather_compaction)
+BEGIN
+    SELECT RAISE(ABORT, 'Timestamp is in a compacted period');
+END;
\ No newline at end of file
@@ -0,0 +1,5 @@
+-- no-transaction
+-- Allow freeing pages after compaction through `PRAGMA incremental_vacuum`;
+-- changing the vacuum mode of an existing database requires a full VACUUM
+PRAGMA auto_vacuum = INCREMENTAL;
+VACUUM;
\ No newline at end of file
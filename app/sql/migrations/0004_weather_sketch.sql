@@ -0,0 +1,13 @@
+-- Quantile sketch (t-digest) per station, UTC day and channel, kept up to
+-- date on load. Run `source_weather_cli sketch` once to build sketches for
+-- data that was loaded before this migration.
+CREATE TABLE weather_sketch (
+    station_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    digest BLOB NOT NULL,
+    PRIMARY KEY (station_id, day, channel)
+) WITHOUT ROWID;
+
+-- For queries across stations
+CREATE INDEX weather_sketch_day ON weather_sketch (day);
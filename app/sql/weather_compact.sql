@@ -0,0 +1,51 @@
+INSERT INTO 
+    weather_compacted
+SELECT 
+    station_id,
+    timestamp - timestamp%{interval_seconds} timestamp,
+    avg(external_temperature_c) external_temperature_c,
+    avg(wind_speed_unmuted_m_s) wind_speed_unmuted_m_s,
+    avg(wind_speed_m_s) wind_speed_m_s,
+    avg(wind_direction_degrees) wind_direction_degrees,
+    avg(radiation_intensity_unmuted_w_m2) radiation_intensity_unmuted_w_m2,
+    avg(radiation_intensity_w_m2) radiation_intensity_w_m2,
+    avg(standard_radiation_intensity_w_m2) standard_radiation_intensity_w_m2,
+    avg(radiation_sum_j_cm2) radiation_sum_j_cm2,
+    avg(radiation_from_plant_w_m2) radiation_from_plant_w_m2,
+    avg(precipitation) precipitation,
+    avg(relative_humidity_perc) relative_humidity_perc,
+    avg(moisture_deficit_g_kg) moisture_deficit_g_kg,
+    avg(moisture_deficit_g_m3) moisture_deficit_g_m3,
+    avg(dew_point_temperature_c) dew_point_temperature_c,
+    avg(abs_humidity_g_kg) abs_humidity_g_kg,
+    avg(enthalpy_kj_kg) enthalpy_kj_kg,
+    avg(enthalpy_kj_m3) enthalpy_kj_m3,
+    avg(atmospheric_pressure_hpa) atmospheric_pressure_hpa,
+    count(*) samples
+FROM 
+    weather
+WHERE 
+    timestamp >= {timestamp_after} AND timestamp < {timestamp_before}
+GROUP BY
+    station_id, timestamp - timestamp%{interval_seconds}
+ON CONFLICT(station_id, timestamp) DO UPDATE SET
+    external_temperature_c = (external_temperature_c * samples + excluded.external_temperature_c * excluded.samples) / (samples + excluded.samples),
+    wind_speed_unmuted_m_s = (wind_speed_unmuted_m_s * samples + excluded.wind_speed_unmuted_m_s * excluded.samples) / (samples + excluded.samples),
+    wind_speed_m_s = (wind_speed_m_s * samples + excluded.wind_speed_m_s * excluded.samples) / (samples + excluded.samples),
+    wind_direction_degrees = (wind_direction_degrees * samples + excluded.wind_direction_degrees * excluded.samples) / (samples + excluded.samples),
+    radiation_intensity_unmuted_w_m2 = (radiation_intensity_unmuted_w_m2 * samples + excluded.radiation_intensity_unmuted_w_m2 * excluded.samples) / (samples + excluded.samples),
+    radiation_intensity_w_m2 = (radiation_intensity_w_m2 * samples + excluded.radiation_intensity_w_m2 * excluded.samples) / (samples + excluded.samples),
+    standard_radiation_intensity_w_m2 = (standard_radiation_intensity_w_m2 * samples + excluded.standard_radiation_intensity_w_m2 * excluded.samples) / (samples + excluded.samples),
+    radiation_sum_j_cm2 = (radiation_sum_j_cm2 * samples + excluded.radiation_sum_j_cm2 * excluded.samples) / (samples + excluded.samples),
+    radiation_from_plant_w_m2 = (radiation_from_plant_w_m2 * samples + excluded.radiation_from_plant_w_m2 * excluded.samples) / (samples + excluded.samples),
+    precipitation = (precipitation * samples + excluded.precipitation * excluded.samples) / (samples + excluded.samples),
+    relative_humidity_perc = (relative_humidity_perc * samples + excluded.relative_humidity_perc * excluded.samples) / (samples + excluded.samples),
+    moisture_deficit_g_kg = (moisture_deficit_g_kg * samples + excluded.moisture_deficit_g_kg * excluded.samples) / (samples + excluded.samples),
+    moisture_deficit_g_m3 = (moisture_deficit_g_m3 * samples + excluded.moisture_deficit_g_m3 * excluded.samples) / (samples + excluded.samples),
+    dew_point_temperature_c = (dew_point_temperature_c * samples + excluded.dew_point_temperature_c * excluded.samples) / (samples + excluded.samples),
+    abs_humidity_g_kg = (abs_humidity_g_kg * samples + excluded.abs_humidity_g_kg * excluded.samples) / (samples + excluded.samples),
+    enthalpy_kj_kg = (enthalpy_kj_kg * samples + excluded.enthalpy_kj_kg * excluded.samples) / (samples + excluded.samples),
+    enthalpy_kj_m3 = (enthalpy_kj_m3 * samples + excluded.enthalpy_kj_m3 * excluded.samples) / (samples + excluded.samples),
+    atmospheric_pressure_hpa = (atmospheric_pressure_hpa * samples + excluded.atmospheric_pressure_hpa * excluded.samples) / (samples + excluded.samples),
+    samples = samples + excluded.samples
+;
\ No newline at end of file
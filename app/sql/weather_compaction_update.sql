@@ -0,0 +1,7 @@
+INSERT INTO 
+    weather_compaction (id, before, interval_seconds)
+VALUES 
+    (1, {timestamp_before}, {interval_seconds})
+ON CONFLICT(id) DO UPDATE SET
+    before = max(before, excluded.before)
+;
@@ -0,0 +1,5 @@
+DELETE FROM 
+    weather
+WHERE 
+    timestamp >= {timestamp_after} AND timestamp < {timestamp_before}
+;
\ No newline at end of file
@@ -1,29 +1,64 @@
 SELECT 
-    timestamp - timestamp%{interval_seconds} timestamp,
-    avg(external_temperature_c) external_temperature_c,
-    avg(wind_speed_unmuted_m_s) wind_speed_unmuted_m_s,
-    avg(wind_speed_m_s) wind_speed_m_s,
-    avg(wind_direction_degrees) wind_direction_degrees,
-    avg(radiation_intensity_unmuted_w_m2) radiation_intensity_unmuted_w_m2,
-    avg(radiation_intensity_w_m2) radiation_intensity_w_m2,
-    avg(standard_radiation_intensity_w_m2) standard_radiation_intensity_w_m2,
-    avg(radiation_sum_j_cm2) radiation_sum_j_cm2,
-    avg(radiation_from_plant_w_m2) radiation_from_plant_w_m2,
-    avg(precipitation) precipitation,
-    avg(relative_humidity_perc) relative_humidity_perc,
-    avg(moisture_deficit_g_kg) moisture_deficit_g_kg,
-    avg(moisture_deficit_g_m3) moisture_deficit_g_m3,
-    avg(dew_point_temperature_c) dew_point_temperature_c,
-    avg(abs_humidity_g_kg) abs_humidity_g_kg,
-    avg(enthalpy_kj_kg) enthalpy_kj_kg,
-    avg(enthalpy_kj_m3) enthalpy_kj_m3,
-    avg(atmospheric_pressure_hpa) atmospheric_pressure_hpa
+    :station_id station_id,
+    timestamp - (timestamp + {offset_seconds})%{interval_seconds} timestamp,
+    sum(external_temperature_c * samples) / sum(samples) external_temperature_c,
+    sum(wind_speed_unmuted_m_s * samples) / sum(samples) wind_speed_unmuted_m_s,
+    sum(wind_speed_m_s * samples) / sum(samples) wind_speed_m_s,
+    sum(wind_direction_degrees * samples) / sum(samples) wind_direction_degrees,
+    sum(radiation_intensity_unmuted_w_m2 * samples) / sum(samples) radiation_intensity_unmuted_w_m2,
+    sum(radiation_intensity_w_m2 * samples) / sum(samples) radiation_intensity_w_m2,
+    sum(standard_radiation_intensity_w_m2 * samples) / sum(samples) standard_radiation_intensity_w_m2,
+    sum(radiation_sum_j_cm2 * samples) / sum(samples) radiation_sum_j_cm2,
+    sum(radiation_from_plant_w_m2 * samples) / sum(samples) radiation_from_plant_w_m2,
+    sum(precipitation * samples) / sum(samples) precipitation,
+    sum(relative_humidity_perc * samples) / sum(samples) relative_humidity_perc,
+    sum(moisture_deficit_g_kg * samples) / sum(samples) moisture_deficit_g_kg,
+    sum(moisture_deficit_g_m3 * samples) / sum(samples) moisture_deficit_g_m3,
+    sum(dew_point_temperature_c * samples) / sum(samples) dew_point_temperature_c,
+    sum(abs_humidity_g_kg * samples) / sum(samples) abs_humidity_g_kg,
+    sum(enthalpy_kj_kg * samples) / sum(samples) enthalpy_kj_kg,
+    sum(enthalpy_kj_m3 * samples) / sum(samples) enthalpy_kj_m3,
+    sum(atmospheric_pressure_hpa * samples) / sum(samples) atmospheric_pressure_hpa
 FROM 
-    weather
+    (
+        SELECT 
+            station_id,
+            timestamp,
+            external_temperature_c,
+            wind_speed_unmuted_m_s,
+            wind_speed_m_s,
+            wind_direction_degrees,
+            radiation_intensity_unmuted_w_m2,
+            radiation_intensity_w_m2,
+            standard_radiation_intensity_w_m2,
+            radiation_sum_j_cm2,
+            radiation_from_plant_w_m2,
+            precipitation,
+            relative_humidity_perc,
+            moisture_deficit_g_kg,
+            moisture_deficit_g_m3,
+            dew_point_temperature_c,
+            abs_humidity_g_kg,
+            enthalpy_kj_kg,
+            enthalpy_kj_m3,
+            atmospheric_pressure_hpa,
+            1 samples
+        FROM 
+            weather
+        WHERE 
+            {station_filter}timestamp >= {timestamp_after} AND timestamp < {timestamp_before} + {interval_seconds}
+        UNION ALL
+        SELECT 
+            *
+        FROM 
+            weather_compacted
+        WHERE 
+            {station_filter}timestamp >= {timestamp_after} AND timestamp < {timestamp_before} + {interval_seconds}
+    )
 GROUP BY
-    timestamp - timestamp%{interval_seconds}
+    timestamp - (timestamp + {offset_seconds})%{interval_seconds}
 HAVING 
-    timestamp - timestamp%{interval_seconds} >= {timestamp_after} AND timestamp - timestamp%{interval_seconds} <= {timestamp_before}
+    timestamp - (timestamp + {offset_seconds})%{interval_seconds} >= {timestamp_after} AND timestamp - (timestamp + {offset_seconds})%{interval_seconds} <= {timestamp_before}
 ORDER BY 
     timestamp ASC
 ;
\ No newline at end of file
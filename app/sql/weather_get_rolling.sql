@@ -0,0 +1,91 @@
+SELECT 
+    :station_id station_id,
+    timestamp,
+    external_temperature_c,
+    wind_speed_unmuted_m_s,
+    wind_speed_m_s,
+    wind_direction_degrees,
+    radiation_intensity_unmuted_w_m2,
+    radiation_intensity_w_m2,
+    standard_radiation_intensity_w_m2,
+    radiation_sum_j_cm2,
+    radiation_from_plant_w_m2,
+    precipitation,
+    relative_humidity_perc,
+    moisture_deficit_g_kg,
+    moisture_deficit_g_m3,
+    dew_point_temperature_c,
+    abs_humidity_g_kg,
+    enthalpy_kj_kg,
+    enthalpy_kj_m3,
+    atmospheric_pressure_hpa
+FROM (
+    SELECT 
+        timestamp,
+        row_number() OVER (
+            PARTITION BY timestamp - (timestamp + {offset_seconds})%{step_seconds}
+            ORDER BY timestamp DESC
+        ) step_rank,
+        sum(external_temperature_c * samples) OVER win{divisor} external_temperature_c,
+        sum(wind_speed_unmuted_m_s * samples) OVER win{divisor} wind_speed_unmuted_m_s,
+        sum(wind_speed_m_s * samples) OVER win{divisor} wind_speed_m_s,
+        sum(wind_direction_degrees * samples) OVER win{divisor} wind_direction_degrees,
+        sum(radiation_intensity_unmuted_w_m2 * samples) OVER win{divisor} radiation_intensity_unmuted_w_m2,
+        sum(radiation_intensity_w_m2 * samples) OVER win{divisor} radiation_intensity_w_m2,
+        sum(standard_radiation_intensity_w_m2 * samples) OVER win{divisor} standard_radiation_intensity_w_m2,
+        sum(radiation_sum_j_cm2 * samples) OVER win{divisor} radiation_sum_j_cm2,
+        sum(radiation_from_plant_w_m2 * samples) OVER win{divisor} radiation_from_plant_w_m2,
+        sum(precipitation * samples) OVER win{divisor} precipitation,
+        sum(relative_humidity_perc * samples) OVER win{divisor} relative_humidity_perc,
+        sum(moisture_deficit_g_kg * samples) OVER win{divisor} moisture_deficit_g_kg,
+        sum(moisture_deficit_g_m3 * samples) OVER win{divisor} moisture_deficit_g_m3,
+        sum(dew_point_temperature_c * samples) OVER win{divisor} dew_point_temperature_c,
+        sum(abs_humidity_g_kg * samples) OVER win{divisor} abs_humidity_g_kg,
+        sum(enthalpy_kj_kg * samples) OVER win{divisor} enthalpy_kj_kg,
+        sum(enthalpy_kj_m3 * samples) OVER win{divisor} enthalpy_kj_m3,
+        sum(atmospheric_pressure_hpa * samples) OVER win{divisor} atmospheric_pressure_hpa
+    FROM 
+        (
+            SELECT 
+                station_id,
+                timestamp,
+                external_temperature_c,
+                wind_speed_unmuted_m_s,
+                wind_speed_m_s,
+                wind_direction_degrees,
+                radiation_intensity_unmuted_w_m2,
+                radiation_intensity_w_m2,
+                standard_radiation_intensity_w_m2,
+                radiation_sum_j_cm2,
+                radiation_from_plant_w_m2,
+                precipitation,
+                relative_humidity_perc,
+                moisture_deficit_g_kg,
+                moisture_deficit_g_m3,
+                dew_point_temperature_c,
+                abs_humidity_g_kg,
+                enthalpy_kj_kg,
+                enthalpy_kj_m3,
+                atmospheric_pressure_hpa,
+                1 samples
+            FROM 
+                weather
+            WHERE 
+                {station_filter}timestamp > {timestamp_after} - {window_seconds} AND timestamp <= {timestamp_before}
+            UNION ALL
+            SELECT 
+                *
+            FROM 
+                weather_compacted
+            WHERE 
+                {station_filter}timestamp > {timestamp_after} - {window_seconds} AND timestamp <= {timestamp_before}
+        )
+    WINDOW win AS (
+        ORDER BY timestamp RANGE BETWEEN {window_preceding} PRECEDING AND CURRENT ROW
+    )
+)
+WHERE 
+    step_rank = 1 AND timestamp >= {timestamp_after}
+ORDER BY 
+    timestamp ASC
+;
\ No newline at end of file
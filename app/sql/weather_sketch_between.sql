@@ -0,0 +1,11 @@
+SELECT
+    day,
+    channel,
+    digest
+FROM
+    weather_sketch
+WHERE
+    {station_filter}channel IN ({channels}) AND
+    day >= {day_after} AND day < {day_before}
+ORDER BY
+    day;
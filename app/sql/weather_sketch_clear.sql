@@ -0,0 +1,14 @@
+-- Days with compacted data can't be sketched again, so their sketches are kept
+DELETE FROM
+    weather_sketch
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            weather_compacted
+        WHERE
+            weather_compacted.station_id = weather_sketch.station_id
+            AND weather_compacted.timestamp >= weather_sketch.day * 86400
+            AND weather_compacted.timestamp < (weather_sketch.day + 1) * 86400
+    );
@@ -0,0 +1,7 @@
+SELECT
+    channel,
+    digest
+FROM
+    weather_sketch
+WHERE
+    station_id = :station_id AND day = :day;
@@ -0,0 +1,19 @@
+-- Raw rows of the days that have no compacted data, i.e. those whose
+-- sketches can be rebuilt
+SELECT
+    *
+FROM
+    weather
+WHERE
+    NOT EXISTS (
+        SELECT
+            1
+        FROM
+            weather_compacted
+        WHERE
+            weather_compacted.station_id = weather.station_id
+            AND weather_compacted.timestamp >= weather.timestamp - weather.timestamp % 86400
+            AND weather_compacted.timestamp < weather.timestamp - weather.timestamp % 86400 + 86400
+    )
+ORDER BY
+    station_id, timestamp;
@@ -0,0 +1,6 @@
+INSERT INTO
+    weather_sketch (station_id, day, channel, digest)
+VALUES
+    (:station_id, :day, :channel, :digest)
+ON CONFLICT (station_id, day, channel) DO UPDATE SET
+    digest = excluded.digest;
@@ -0,0 +1,200 @@
+"""Responsible for noticing new files in a directory tree, e.g. raw data dropped
+by the meteo station"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import time
+
+# Flags from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+
+class _Inotify:
+    """Minimal inotify binding; only used to wake up as soon as something
+    changes, the actual changes are found by scanning"""
+
+    def __init__(self) -> None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._watched: set[str] = set()
+
+    def watch(self, path: str) -> None:
+        if path in self._watched:
+            return
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if self._add_watch(self._fd, os.fsencode(path), mask) >= 0:
+            self._watched.add(path)
+
+    def wait(self, timeout: float) -> None:
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def _inotify() -> _Inotify | None:
+    try:
+        return _Inotify()
+    except (OSError, AttributeError, TypeError):
+        # Not on Linux, or no inotify available
+        return None
+
+
+class DirectoryWatcher:
+    """Finds files that were added to a directory tree since they were last
+    committed
+
+    Progress is kept per directory: the inode and size of every committed
+    file, by name. Modification times can't be used for this, since files
+    moved in with `mv` or `rsync -t` keep their (old) modification time. The
+    modification time of every directory is indexed as well, so that only
+    directories that changed are listed again. Both are persisted in a state
+    file, so that a restart picks up where it left off.
+    """
+
+    def __init__(self, path: str, state_path: str, settle_seconds: float = 1.0):
+        self._path = os.path.abspath(path)
+        self._state_path = os.path.abspath(state_path)
+        self._settle_ns = int(settle_seconds * 1e9)
+        # Directory -> (mtime when last listed, subdirectories)
+        self._dirs: dict[str, tuple[int, list[str]]] = {}
+        # Directory -> file name -> (inode, size) when committed
+        self._processed: dict[str, dict[str, tuple[int, int]]] = {}
+        self._pending: dict[str, int] = {}
+        self._inotify = _inotify()
+        self._load_state()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify is not None
+
+    def wait(self, timeout: float) -> None:
+        """Blocks until something might have changed, or `timeout` passed"""
+        if self._inotify is not None:
+            self._inotify.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+    def poll(self) -> list[str]:
+        """Returns new files, oldest first; a file is only returned once it
+        hasn't been modified for `settle_seconds`"""
+        self._scan(self._path)
+        # Writing to a file doesn't touch its directory, so refresh the mtime
+        # of files that were seen earlier, but may still be being written
+        for path in list(self._pending):
+            try:
+                self._pending[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                del self._pending[path]
+        now = time.time_ns()
+        ready = sorted(
+            (mtime, path)
+            for path, mtime in self._pending.items()
+            if now - mtime >= self._settle_ns
+        )
+        return [path for _, path in ready]
+
+    def commit(self, paths: list[str]) -> None:
+        """Marks files as processed, and persists progress"""
+        for path in paths:
+            self._pending.pop(path)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            directory, name = os.path.split(path)
+            files = self._processed.setdefault(directory, {})
+            files[name] = (stat.st_ino, stat.st_size)
+        self._save_state()
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def _scan(self, directory: str) -> None:
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            self._dirs.pop(directory, None)
+            self._processed.pop(directory, None)
+            return
+        if self._inotify is not None:
+            self._inotify.watch(directory)
+        indexed = self._dirs.get(directory)
+        if indexed is not None and indexed[0] == mtime:
+            subdirs = indexed[1]
+        else:
+            subdirs = self._list(directory)
+            self._dirs[directory] = (mtime, subdirs)
+        for subdir in subdirs:
+            self._scan(subdir)
+
+    def _list(self, directory: str) -> list[str]:
+        subdirs = []
+        processed = self._processed.pop(directory, {})
+        # Files that were removed are forgotten, so the state doesn't grow
+        # without bounds when old files are cleaned up
+        still_processed = {}
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.path == self._state_path:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    key = (stat.st_ino, stat.st_size)
+                    if processed.get(entry.name) == key:
+                        still_processed[entry.name] = key
+                    else:
+                        self._pending[entry.path] = stat.st_mtime_ns
+        if still_processed:
+            self._processed[directory] = still_processed
+        return sorted(subdirs)
+
+    def _load_state(self) -> None:
+        try:
+            with open(self._state_path, "r") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        if state.get("path") != self._path:
+            return
+        self._pending = state.get("pending", {})
+        self._dirs = {
+            path: (mtime, subdirs) for path, (mtime, subdirs) in state["dirs"].items()
+        }
+        self._processed = {
+            directory: {name: (ino, size) for name, (ino, size) in files.items()}
+            for directory, files in state["processed"].items()
+        }
+
+    def _save_state(self) -> None:
+        state = {
+            "path": self._path,
+            "dirs": self._dirs,
+            "processed": self._processed,
+            # Seen, but not yet committed; these would otherwise be missed,
+            # since their directory won't be listed again
+            "pending": self._pending,
+        }
+        tmp_path = self._state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self._state_path)
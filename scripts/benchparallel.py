@@ -0,0 +1,144 @@
+"""Benchmark for parallel timeseries queries
+
+Generates a database of synthetic 5-minute data (unless `--db` points to an
+existing one), and times `get_between` over the whole range for each
+parallelism, reporting the speedup against a single query. Sub-range queries
+run on threads; SQLite releases the GIL while it executes a query, so they can
+use as many cores as there are sub-ranges. On a single core, expect no speedup.
+
+    python scripts/benchparallel.py --days 1095 --parallelism 1,2,4,8
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.drivers import SQLiteConnection  # noqa: E402
+from app.entities import CHANNELS, WeatherBatch  # noqa: E402
+from app.gateways import SQLWeatherDbGateway  # noqa: E402
+from app.migrations import SQLMigrator  # noqa: E402
+
+START = datetime(2019, 1, 1, tzinfo=timezone.utc)
+SAMPLE_INTERVAL = timedelta(minutes=5)
+
+
+def generate(path: str, days: int, seed: int = 0) -> None:
+    """Fills a new database with `days` of random data, a month per batch"""
+    rng = random.Random(seed)
+    conn = SQLiteConnection(path)
+    SQLMigrator(conn).migrate()
+    gateway = SQLWeatherDbGateway(conn)
+    per_day = timedelta(days=1) // SAMPLE_INTERVAL
+    for first_day in range(0, days, 30):
+        rows = []
+        for i in range(min(30, days - first_day) * per_day):
+            row: dict[str, Any] = {
+                "station_id": "bench",
+                "timestamp": START + timedelta(days=first_day) + i * SAMPLE_INTERVAL,
+            }
+            for key in CHANNELS:
+                row[key] = rng.gauss(10, 5)
+            rows.append(row)
+        gateway.load(WeatherBatch.from_rows(rows))
+    conn.close()
+
+
+def measure(
+    path: str,
+    days: int,
+    interval: timedelta,
+    parallelism: int,
+    repeat: int,
+) -> float:
+    """Best time of `repeat` queries over the whole range, in seconds"""
+    conn = SQLiteConnection(path)
+    gateway = SQLWeatherDbGateway(
+        conn,
+        connect=conn.reopen,
+        parallelism=parallelism,
+        split_threshold=timedelta(0),
+    )
+    best = float("inf")
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            gateway.get_between(START, START + timedelta(days=days), interval)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        conn.close()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark for parallel timeseries queries",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument(
+        "--db", help="database to query; generated if it doesn't exist yet"
+    )
+    parser.add_argument(
+        "--days", type=int, default=3 * 365, help="days of data (default 1095)"
+    )
+    parser.add_argument(
+        "--parallelism",
+        default="1,2,4",
+        help="comma separated parallelisms to compare (default 1,2,4)",
+    )
+    parser.add_argument(
+        "--interval",
+        default="3600,86400",
+        help="comma separated bucket sizes in seconds (default 3600,86400)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.parallelism.split(",")]
+    intervals = [int(seconds) for seconds in args.interval.split(",")]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.db or os.path.join(directory, "bench.sqlite")
+        if not os.path.exists(path):
+            print(f"Generating {args.days} days of data in {path}")
+            generate(path, args.days)
+        print(f"{os.cpu_count()} cores")
+        results = []
+        for seconds in intervals:
+            baseline = None
+            for parallelism in levels:
+                elapsed = measure(
+                    path,
+                    args.days,
+                    timedelta(seconds=seconds),
+                    parallelism,
+                    args.repeat,
+                )
+                baseline = baseline or elapsed
+                results.append(
+                    {
+                        "interval_seconds": seconds,
+                        "parallelism": parallelism,
+                        "seconds": elapsed,
+                        "speedup": baseline / elapsed,
+                    }
+                )
+                print(
+                    f"interval {seconds:>6} s, parallelism {parallelism:>2}: "
+                    f"{elapsed * 1000:8.1f} ms, speedup {baseline / elapsed:4.2f}"
+                )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cores": os.cpu_count(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
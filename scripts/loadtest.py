@@ -0,0 +1,367 @@
+"""Load test for the weather API
+
+Replays a weighted mix of requests (creating tokens, posting data and the
+latest, average and timeseries endpoints) at a fixed concurrency, and reports
+throughput, latency percentiles and error rates per endpoint. With `--ramp`,
+it steps through increasing concurrencies to find where throughput stops
+growing and latency starts to pile up instead.
+
+By default, the app runs in-process (through httpx' ASGI transport) on a fresh
+temporary database, seeded with the files in `--seed`. Note that client and
+app then share a process. Use `--url` to test a running server instead, e.g.
+one started with `uvicorn app.main:app`; its database should hold some data.
+
+Posted data goes to station `loadtest`, after both the latest data and the
+current time, so it's never in a compacted period. Its rows are deleted when
+the run ends; against a server, that needs `--db` to point to its database.
+Otherwise they stay behind, and skew queries over all stations, so test
+against a throwaway copy of the database, or delete them afterwards with
+`source_weather_cli delete-station loadtest`.
+
+    python scripts/loadtest.py --concurrency 8 --duration 10
+    python scripts/loadtest.py --ramp 1,2,4,8,16,32 --mix latest=1,timeseries=1
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.cli import get_interactor  # noqa: E402
+from app.drivers import SQLiteConnection  # noqa: E402
+from app.entities import CHANNELS  # noqa: E402
+
+ENDPOINTS = ("token", "post", "latest", "average", "timeseries")
+STATION_ID = "loadtest"
+DEFAULT_MIX = "token=1,post=1,latest=4,average=2,timeseries=2"
+LOGIN = {
+    "username": "john@company.com",
+    "password": "password1",
+    "scope": "weather:read weather:write",
+}
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parses `endpoint=weight,...`; endpoints that are left out aren't hit"""
+    weights = {}
+    for item in mix.split(","):
+        endpoint, _, weight = item.partition("=")
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {endpoint!r}; pick from {ENDPOINTS}")
+        weights[endpoint] = float(weight or 1)
+    if not any(weights.values()):
+        raise ValueError("At least one endpoint needs a positive weight")
+    return weights
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of sorted `values`"""
+    if not values:
+        return float("nan")
+    # The smallest value with at least p% of values at or below it
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Stats:
+    """Latencies and errors of one endpoint"""
+
+    def __init__(self) -> None:
+        self.latencies: list[float] = []
+        self.errors = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.latencies.append(latency)
+        if not ok:
+            self.errors += 1
+
+    def merge(self, other: "Stats") -> None:
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+
+    def summary(self, seconds: float) -> dict[str, float]:
+        latencies = sorted(self.latencies)
+        n = len(latencies)
+        return {
+            "requests": n,
+            "errors": self.errors,
+            "error_rate": self.errors / n if n else 0.0,
+            "throughput": n / seconds,
+            **{f"p{p}_ms": percentile(latencies, p) * 1000 for p in (50, 90, 99)},
+            "max_ms": latencies[-1] * 1000 if latencies else float("nan"),
+        }
+
+
+class Scenario:
+    """The requests to replay; read queries cover the day before the latest
+    data point, so they hit data both in-process and against a server"""
+
+    def __init__(self, client: httpx.AsyncClient, token: str, latest: datetime):
+        self._client = client
+        self._headers = {"Authorization": f"Bearer {token}"}
+        self._latest = latest
+        # Posted data must be new, also to a server that saw earlier runs, and
+        # may not fall in a compacted period, which ends before the present
+        self._next_post = max(latest, datetime.now(timezone.utc))
+        self.requests: dict[str, Callable[[], Awaitable[httpx.Response]]] = {
+            "token": self.token,
+            "post": self.post,
+            "latest": self.latest,
+            "average": self.average,
+            "timeseries": self.timeseries,
+        }
+
+    @classmethod
+    async def create(cls, client: httpx.AsyncClient) -> "Scenario":
+        response = await client.post("/token", data=LOGIN)
+        response.raise_for_status()
+        token = response.json()["access_token"]
+        response = await client.get(
+            "/weather/latest", headers={"Authorization": f"Bearer {token}"}
+        )
+        response.raise_for_status()
+        latest = datetime.fromisoformat(response.json()["timestamp"])
+        return cls(client, token, latest)
+
+    def token(self) -> Awaitable[httpx.Response]:
+        return self._client.post("/token", data=LOGIN)
+
+    def post(self) -> Awaitable[httpx.Response]:
+        self._next_post += timedelta(seconds=1)
+        payload = {
+            "name": STATION_ID,
+            "ts": self._next_post.isoformat(),
+            "rows": [[key, random.uniform(0, 100)] for key in CHANNELS],
+        }
+        return self._client.post("/weather", json=[payload], headers=self._headers)
+
+    def latest(self) -> Awaitable[httpx.Response]:
+        return self._client.get("/weather/latest", headers=self._headers)
+
+    def average(self) -> Awaitable[httpx.Response]:
+        params = {"after": (self._latest - timedelta(hours=6)).isoformat()}
+        return self._client.get(
+            "/weather/average", params=params, headers=self._headers
+        )
+
+    def timeseries(self) -> Awaitable[httpx.Response]:
+        params = {
+            "after": (self._latest - timedelta(days=1)).isoformat(),
+            "before": self._latest.isoformat(),
+            "interval_seconds": "900",
+        }
+        return self._client.get(
+            "/weather/timeseries", params=params, headers=self._headers
+        )
+
+
+async def run(
+    scenario: Scenario,
+    mix: dict[str, float],
+    concurrency: int,
+    duration: float,
+    seed: int = 0,
+) -> tuple[dict[str, Stats], float]:
+    """Runs `concurrency` closed-loop workers, each sending its next request as
+    soon as the previous one completed; returns stats and elapsed seconds"""
+    endpoints = list(mix)
+    weights = [mix[endpoint] for endpoint in endpoints]
+    deadline = time.perf_counter() + duration
+
+    async def worker(rng: random.Random) -> dict[str, Stats]:
+        stats = {endpoint: Stats() for endpoint in endpoints}
+        while time.perf_counter() < deadline:
+            endpoint = rng.choices(endpoints, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await scenario.requests[endpoint]()
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            stats[endpoint].record(time.perf_counter() - start, ok)
+        return stats
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(worker(random.Random(seed + i)) for i in range(concurrency))
+    )
+    elapsed = time.perf_counter() - start
+    merged = {endpoint: Stats() for endpoint in endpoints}
+    for stats in results:
+        for endpoint, s in stats.items():
+            merged[endpoint].merge(s)
+    return merged, elapsed
+
+
+def report(stats: dict[str, Stats], seconds: float) -> dict[str, dict[str, float]]:
+    total = Stats()
+    for s in stats.values():
+        total.merge(s)
+    return {
+        **{endpoint: s.summary(seconds) for endpoint, s in stats.items()},
+        "total": total.summary(seconds),
+    }
+
+
+def print_report(summary: dict[str, dict[str, float]]) -> None:
+    header = ("endpoint", "requests", "req/s", "err %", "p50 ms", "p90 ms")
+    print(
+        "{:<12}{:>10}{:>10}{:>8}{:>10}{:>10}{:>10}{:>10}".format(
+            *header, "p99 ms", "max ms"
+        )
+    )
+    for endpoint, s in summary.items():
+        print(
+            f"{endpoint:<12}{s['requests']:>10}{s['throughput']:>10.1f}"
+            f"{s['error_rate']:>8.1%}{s['p50_ms']:>10.1f}{s['p90_ms']:>10.1f}"
+            f"{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+        )
+
+
+async def ramp(
+    scenario: Scenario,
+    mix: dict[str, float],
+    levels: list[int],
+    duration: float,
+    growth: float = 1.1,
+) -> list[dict[str, Any]]:
+    """Runs each concurrency level in turn, and reports the level from which
+    throughput no longer grows by a factor `growth` per step; beyond that
+    point, more concurrent requests only queue up, so latency rises instead"""
+    steps = []
+    for concurrency in levels:
+        stats, elapsed = await run(scenario, mix, concurrency, duration)
+        total = report(stats, elapsed)["total"]
+        step: dict[str, Any] = {"concurrency": concurrency, **total}
+        steps.append(step)
+        print(
+            f"concurrency {concurrency:>4}: {total['throughput']:8.1f} req/s, "
+            f"p50 {total['p50_ms']:7.1f} ms, p99 {total['p99_ms']:7.1f} ms, "
+            f"errors {total['error_rate']:.1%}"
+        )
+    saturated = saturation(steps, growth)
+    if saturated is None:
+        print("Throughput still grows at the highest concurrency")
+    else:
+        print(
+            f"Saturates at concurrency {saturated['concurrency']}: "
+            f"{saturated['throughput']:.1f} req/s, p99 {saturated['p99_ms']:.1f} ms"
+        )
+    return steps
+
+
+def saturation(
+    steps: list[dict[str, Any]], growth: float = 1.1
+) -> dict[str, Any] | None:
+    """Last step with `growth` times the throughput of all steps before it;
+    None if that is the last step, so saturation may not be reached yet"""
+    best = None
+    for step in steps:
+        if best is None or step["throughput"] >= best["throughput"] * growth:
+            best = step
+    return best if best is not steps[-1] else None
+
+
+def in_process_client(seed: str, db_path: str) -> httpx.AsyncClient:
+    """Client for the app itself, on a database seeded with files from `seed`"""
+    from app.main import app, sql_connection
+
+    paths = [
+        os.path.join(subdir, file)
+        for subdir, _, files in os.walk(seed)
+        for file in files
+        if file.endswith(".json")
+    ]
+    get_interactor(db_path).load(paths)
+    app.dependency_overrides[sql_connection] = lambda: SQLiteConnection(db_path)
+    transport = httpx.ASGITransport(app=app)  # type: ignore[arg-type]
+    return httpx.AsyncClient(transport=transport, base_url="http://loadtest")
+
+
+def cleanup(db_path: str) -> int:
+    """Deletes the posted data from the database; returns the rows deleted"""
+    return get_interactor(db_path).delete_station(STATION_ID)
+
+
+async def main_async(args: argparse.Namespace) -> Any:
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as directory:
+        if args.url:
+            db_path = args.db
+            client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        else:
+            db_path = os.path.join(directory, "db.sqlite")
+            client = in_process_client(args.seed, db_path)
+        try:
+            async with client:
+                scenario = await Scenario.create(client)
+                if args.ramp:
+                    levels = [int(level) for level in args.ramp.split(",")]
+                    return await ramp(scenario, mix, levels, args.duration)
+                stats, elapsed = await run(
+                    scenario, mix, args.concurrency, args.duration
+                )
+                summary = report(stats, elapsed)
+                print_report(summary)
+                return summary
+        finally:
+            if db_path:
+                cleanup(db_path)
+            elif "post" in mix:
+                print(
+                    f"Posted data is left in station {STATION_ID}; delete it with "
+                    f"`source_weather_cli delete-station {STATION_ID}`"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test for the weather API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=__doc__,
+    )
+    parser.add_argument("--url", help="server to test; in-process if omitted")
+    parser.add_argument(
+        "--db",
+        help="database of the server at `--url`, to delete the posted data from "
+        "when the run ends",
+    )
+    parser.add_argument(
+        "--seed",
+        default="./data",
+        help="files to seed the in-process database with (default ./data)",
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help=f"weighted endpoint mix (default {DEFAULT_MIX})",
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--duration", type=float, default=10, help="seconds per run or ramp step"
+    )
+    parser.add_argument(
+        "--ramp", help="comma separated concurrencies, e.g. 1,2,4,8,16,32"
+    )
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    result = asyncio.run(main_async(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,12 @@ import pytest
 
 from app.adapters import RawWeatherData
 from app.drivers import SQLiteConnection
-from app.entities import WeatherData
+from app.entities import WeatherBatch, WeatherData
 from app.gateways import SQLWeatherDbGateway
 from app.interactors import (
     WeatherInteractor,
 )
+from app.migrations import SQLMigrator
 
 TZ = timedelta(seconds=7200)
 
@@ -33,16 +34,18 @@ def data(raw_data: list[dict[str, Any]]) -> list[WeatherData]:
     return [RawWeatherData.parse_obj(d).transform() for d in raw_data]
 
 
+@pytest.fixture
+def batch(raw_data: list[dict[str, Any]]) -> WeatherBatch:
+    return WeatherBatch.from_rows(
+        RawWeatherData.parse_obj(d).to_row() for d in raw_data
+    )
+
+
 @pytest.fixture
 def db_path(tmpdir: pathlib.Path) -> pathlib.Path:
     path = tmpdir / "db.sqlite"
     conn = SQLiteConnection(path)
-    cur = conn.cursor()
-    with open("./app/sql/weather_create_table.sql") as f:
-        operations = f.read().split(";")
-    for operation in operations:
-        cur.execute(operation)
-    conn.commit()
+    SQLMigrator(conn).migrate()
     conn.close()
     return path
 
@@ -56,5 +59,5 @@ def interactor(db_path: pathlib.Path) -> WeatherInteractor:
 
 
 @pytest.fixture
-def prepopulated_db(interactor: WeatherInteractor, data: list[WeatherData]) -> None:
-    interactor.load(data)
+def prepopulated_db(interactor: WeatherInteractor, batch: WeatherBatch) -> None:
+    interactor.load(batch)
@@ -0,0 +1,18 @@
+import importlib.util
+import pathlib
+from datetime import timedelta
+
+_spec = importlib.util.spec_from_file_location(
+    "benchparallel", "./scripts/benchparallel.py"
+)
+assert _spec is not None and _spec.loader is not None
+benchparallel = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(benchparallel)
+
+
+def test_measure(tmp_path: pathlib.Path):
+    path = str(tmp_path / "bench.sqlite")
+    benchparallel.generate(path, days=3)
+    for parallelism in (1, 2):
+        elapsed = benchparallel.measure(path, 3, timedelta(hours=1), parallelism, 1)
+        assert elapsed > 0
@@ -0,0 +1,50 @@
+from datetime import timedelta, timezone
+
+import pytest
+
+from app.entities import CHANNELS, WeatherBatch, WeatherData
+from app.interactors import LatestWeatherQuery, WeatherInteractor
+
+
+def test_batch_round_trip(data: list[WeatherData]):
+    batch = WeatherBatch.from_weather(data)
+    assert len(batch) == len(data)
+    assert batch.stations == [data[0].station_id]
+    tz = timezone(timedelta(hours=2))
+    converted = batch.to_weather(tz=tz)
+    assert converted == data
+    assert converted[0].timestamp.utcoffset() == timedelta(hours=2)
+
+
+def test_batch_slicing_does_not_copy(batch: WeatherBatch):
+    part = batch[10:20]
+    assert len(part) == 10
+    assert part.timestamps.obj is batch.timestamps.obj
+    assert part.column("precipitation").obj is batch.column("precipitation").obj
+    assert list(part.timestamps) == list(batch.timestamps[10:20])
+
+
+def test_batch_records(batch: WeatherBatch):
+    records = list(batch)
+    assert len(records) == len(batch)
+    record = records[3]
+    assert record.timestamp == batch.timestamps[3]
+    assert record.station_id == batch.stations[0]
+    for key in CHANNELS:
+        assert getattr(record, key) == batch.column(key)[3]
+    assert batch[3].timestamp == record.timestamp
+    with pytest.raises(AttributeError):
+        record.foo = 1  # type: ignore[attr-defined]
+
+
+def test_batch_missing_channel():
+    row = {"station_id": "a", "timestamp": 0, "precipitation": 1.0}
+    with pytest.raises(ValueError):
+        WeatherBatch.from_rows([row])
+
+
+def test_load_batch(interactor: WeatherInteractor, batch: WeatherBatch):
+    interactor.load(batch[:-1])
+    tz = timedelta(hours=2)
+    expected = max(batch[:-1].to_weather(tz=timezone(tz)), key=lambda d: d.timestamp)
+    assert interactor.get(LatestWeatherQuery(tz_offset=tz)) == [expected]
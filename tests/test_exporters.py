@@ -0,0 +1,38 @@
+import io
+
+import pytest
+
+from app.exporters import COLUMNS, export
+
+
+def batches(days: int, batch_size: int):
+    timestamps = list(range(0, days * 86400, 3600))
+    for start in range(0, len(timestamps), batch_size):
+        chunk = timestamps[start : start + batch_size]
+        batch: dict[str, list] = {key: [1.0] * len(chunk) for key in COLUMNS}
+        batch["station_id"] = ["a"] * len(chunk)
+        batch["timestamp"] = chunk
+        batch["samples"] = [1] * len(chunk)
+        yield batch
+
+
+def test_export_csv():
+    lines = b"".join(export(batches(2, 10), "csv")).decode().splitlines()
+    assert lines[0].split(",") == COLUMNS
+    assert len(lines) == 49
+
+
+def test_export_parquet_row_group_per_day():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = b"".join(export(batches(3, 10), "parquet"))
+    parquet = pq.ParquetFile(io.BytesIO(data))
+    assert parquet.metadata.num_row_groups == 3
+    assert [parquet.metadata.row_group(i).num_rows for i in range(3)] == [24, 24, 24]
+
+
+def test_export_arrow():
+    pa = pytest.importorskip("pyarrow")
+    data = b"".join(export(batches(3, 10), "arrow"))
+    table = pa.ipc.open_stream(data).read_all()
+    assert table.num_rows == 72
+    assert table.column_names == COLUMNS
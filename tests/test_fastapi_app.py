@@ -1,3 +1,7 @@
+import csv
+import gzip
+import io
+import json
 import pathlib
 import sqlite3
 from typing import Any
@@ -7,6 +11,7 @@ from fastapi.testclient import TestClient
 
 from app.drivers import SQLiteConnection
 from app.main import app, sql_connection
+from app.middleware import CompressionMiddleware
 
 
 @pytest.fixture
@@ -58,6 +63,15 @@ def test_post_twice(
     assert response.content == b'{"detail":"Can\'t upload the same timestamp twice"}'
 
 
+def test_post_missing_value(
+    client: TestClient, raw_data: list[dict], auth_headers: dict[str, str]
+):
+    rows = [r for r in raw_data[0]["rows"] if r[0] != "external_temperature_c"]
+    datapoint = {**raw_data[0], "rows": rows}
+    response = client.post("/weather", json=[datapoint], headers=auth_headers)
+    assert response.status_code == 422
+
+
 @pytest.mark.usefixtures("prepopulated_db")
 def test_weather_get_latest(client: TestClient, auth_headers: dict[str, str]):
     response = client.get(
@@ -84,6 +98,28 @@ def test_weather_get_average(client: TestClient, auth_headers: dict[str, str]):
     assert data["wind_direction_degrees"] == 317.0833333333333
 
 
+@pytest.mark.usefixtures("prepopulated_db")
+@pytest.mark.parametrize(
+    "endpoint, params",
+    [
+        ("latest", {"station_id": "unknown"}),
+        ("average", {"station_id": "unknown", "after": "2021-05-01T00:00:00Z"}),
+        ("average", {"after": "2021-06-01T00:00:00Z"}),
+    ],
+)
+def test_weather_get_without_data(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    endpoint: str,
+    params: dict[str, str],
+):
+    response = client.get(f"/weather/{endpoint}", params=params, headers=auth_headers)
+    assert response.status_code == 404
+    assert response.json()["detail"].startswith(
+        "No data for station unknown" if "station_id" in params else "No data since"
+    )
+
+
 @pytest.mark.usefixtures("prepopulated_db")
 def test_weather_get_timeseries(client: TestClient, auth_headers: dict[str, str]):
     response = client.get(
@@ -100,3 +136,311 @@ def test_weather_get_timeseries(client: TestClient, auth_headers: dict[str, str]
     assert response.status_code == 200
     assert len(data["timestamp"]) == 24
     assert data["wind_direction_degrees"][-1] == 317.0833333333333
+
+
+def test_post_gzip(
+    client: TestClient,
+    raw_data: list[dict[str, Any]],
+    db_path: pathlib.Path,
+    auth_headers: dict[str, str],
+):
+    body = gzip.compress(json.dumps(raw_data).encode())
+    headers = {**auth_headers, "Content-Encoding": "gzip"}
+    response = client.post("/weather", content=body, headers=headers)
+    assert response.status_code == 201
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM weather")
+    assert cur.fetchone() == (len(raw_data),)
+
+
+def test_post_corrupt_gzip(client: TestClient, auth_headers: dict[str, str]):
+    headers = {**auth_headers, "Content-Encoding": "gzip"}
+    response = client.post("/weather", content=b"not gzip", headers=headers)
+    assert response.status_code == 400
+
+
+def _compress(encoding: str, data: bytes) -> bytes:
+    if encoding == "gzip":
+        return gzip.compress(data)
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_post_concatenated(
+    client: TestClient,
+    raw_data: list[dict[str, Any]],
+    db_path: pathlib.Path,
+    auth_headers: dict[str, str],
+    encoding: str,
+):
+    # Concatenated gzip members or zstd frames make up a single body
+    body = json.dumps(raw_data).encode()
+    half = len(body) // 2
+    compressed = _compress(encoding, body[:half]) + _compress(encoding, body[half:])
+    headers = {**auth_headers, "Content-Encoding": encoding}
+    response = client.post("/weather", content=compressed, headers=headers)
+    assert response.status_code == 201
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*) FROM weather")
+    assert cur.fetchone() == (len(raw_data),)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_post_truncated(
+    client: TestClient,
+    raw_data: list[dict[str, Any]],
+    auth_headers: dict[str, str],
+    encoding: str,
+):
+    compressed = _compress(encoding, json.dumps(raw_data[:1]).encode())
+    headers = {**auth_headers, "Content-Encoding": encoding}
+    response = client.post("/weather", content=compressed[:-4], headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_post_too_large(auth_headers: dict[str, str], encoding: str):
+    compressed = _compress(encoding, b"[" + b" " * 10_000_000 + b"]")
+    client = TestClient(CompressionMiddleware(app, max_request_size=1_000_000))
+    headers = {**auth_headers, "Content-Encoding": encoding}
+    response = client.post("/weather", content=compressed, headers=headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_timeseries_compressed(
+    client: TestClient, auth_headers: dict[str, str]
+):
+    response = client.get(
+        "/weather/timeseries",
+        params={
+            "after": "2021-05-01T02:00:00+02:00",
+            "before": "2021-05-02T02:00:00+02:00",
+            "interval_seconds": 300,
+        },
+        headers={**auth_headers, "Accept-Encoding": "gzip"},
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) < len(response.content)
+    assert len(response.json()["timestamp"]) == 288
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_latest_not_compressed(
+    client: TestClient, auth_headers: dict[str, str]
+):
+    response = client.get(
+        "/weather/latest", headers={**auth_headers, "Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_timeseries_downsampled(
+    client: TestClient, auth_headers: dict[str, str]
+):
+    response = client.get(
+        "/weather/timeseries",
+        params={
+            "after": "2021-05-01T02:00:00+02:00",
+            "before": "2021-05-02T02:00:00+02:00",
+            "interval_seconds": 300,
+            "max_points": 50,
+        },
+        headers=auth_headers,
+    )
+    data = response.json()
+    assert response.status_code == 200
+    assert "timestamp" not in data
+    series = data["radiation_intensity_w_m2"]
+    assert 0 < len(series["timestamp"]) == len(series["value"]) <= 50
+    assert series["timestamp"] == sorted(series["timestamp"])
+    full = client.get(
+        "/weather/timeseries",
+        params={
+            "after": "2021-05-01T02:00:00+02:00",
+            "before": "2021-05-02T02:00:00+02:00",
+            "interval_seconds": 300,
+        },
+        headers=auth_headers,
+    ).json()
+    assert max(series["value"]) == max(full["radiation_intensity_w_m2"])
+    assert min(series["value"]) == min(full["radiation_intensity_w_m2"])
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_timeseries_filled(
+    client: TestClient, auth_headers: dict[str, str]
+):
+    response = client.get(
+        "/weather/timeseries",
+        params={
+            "after": "2021-05-01T00:00:00+02:00",
+            "before": "2021-05-02T06:00:00+02:00",
+            "interval_seconds": 3600,
+            "tz_offset_seconds": 7200,
+            "fill": "ffill",
+        },
+        headers=auth_headers,
+    )
+    data = response.json()
+    assert response.status_code == 200
+    assert len(data["timestamp"]) == 31
+    assert data["timestamp"][0] == "2021-05-01T00:00:00+02:00"
+    assert data["wind_direction_degrees"][:2] == [None, None]
+    assert data["wind_direction_degrees"][-1] == 317.0833333333333
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_rolling(client: TestClient, auth_headers: dict[str, str]):
+    response = client.get(
+        "/weather/rolling",
+        params={
+            "after": "2021-05-01T02:00:00+02:00",
+            "before": "2021-05-02T02:00:00+02:00",
+            "window_seconds": 86400,
+            "step_seconds": 300,
+            "aggregate": "sum",
+            "tz_offset_seconds": 7200,
+        },
+        headers=auth_headers,
+    )
+    data = response.json()
+    assert response.status_code == 200
+    assert len(data["timestamp"]) == 288
+    assert data["precipitation"] == sorted(data["precipitation"])
+
+
+@pytest.mark.parametrize(
+    "before, interval_seconds",
+    [
+        ("2021-05-02T00:00:00+02:00", 0),
+        ("2021-05-02T00:00:00+02:00", 0.5),
+        ("2021-05-02T00:00:00+02:00", -60),
+        # Too many buckets
+        ("2022-05-01T00:00:00+02:00", 1),
+    ],
+)
+def test_weather_get_timeseries_invalid_interval(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    before: str,
+    interval_seconds: float,
+):
+    params: dict[str, Any] = {
+        "after": "2021-05-01T00:00:00+02:00",
+        "before": before,
+        "interval_seconds": interval_seconds,
+        "fill": "null",
+    }
+    response = client.get("/weather/timeseries", params=params, headers=auth_headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_timeseries_in_parallel(
+    client: TestClient, auth_headers: dict[str, str], monkeypatch: pytest.MonkeyPatch
+):
+    params: dict[str, Any] = {
+        "after": "2021-05-01T02:00:00+02:00",
+        "before": "2021-05-02T02:00:00+02:00",
+        "interval_seconds": 300,
+    }
+    expected = client.get("/weather/timeseries", params=params, headers=auth_headers)
+    # Sub-range queries open connections to the overridden database too
+    monkeypatch.setattr("app.main.QUERY_PARALLELISM", 4)
+    monkeypatch.setattr("app.main.QUERY_SPLIT_THRESHOLD_DAYS", 0)
+    response = client.get("/weather/timeseries", params=params, headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == expected.json()
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_timeseries_streamed(
+    client: TestClient, auth_headers: dict[str, str], monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr("app.main.STREAM_CHUNK_SIZE", 100)
+    params: dict[str, Any] = {
+        "after": "2021-05-01T02:00:00+02:00",
+        "before": "2021-05-02T02:00:00+02:00",
+        "interval_seconds": 300,
+        "tz_offset_seconds": 7200,
+    }
+    expected = client.get(
+        "/weather/timeseries", params=params, headers=auth_headers
+    ).json()
+    response = client.get(
+        "/weather/timeseries", params={**params, "stream": True}, headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    chunks = [json.loads(line) for line in response.text.splitlines()]
+    assert [len(chunk["timestamp"]) for chunk in chunks] == [100, 100, 88]
+    for key, values in expected.items():
+        assert [value for chunk in chunks for value in chunk[key]] == values
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_export_csv(
+    client: TestClient, auth_headers: dict[str, str], raw_data: list[dict]
+):
+    response = client.get(
+        "/weather/export",
+        params={
+            "after": "2021-05-01T00:00:00+02:00",
+            "before": "2021-05-03T00:00:00+02:00",
+            "format": "csv",
+        },
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == len(raw_data)
+    assert rows[0]["timestamp"] == "2021-05-01T00:02:50+00:00"
+    assert rows[0]["station_id"] == "_ws_source_meteo"
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_export_parquet(
+    client: TestClient, auth_headers: dict[str, str], raw_data: list[dict]
+):
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = client.get(
+        "/weather/export",
+        params={
+            "after": "2021-05-01T00:00:00+02:00",
+            "before": "2021-05-03T00:00:00+02:00",
+            "format": "parquet",
+        },
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    parquet = pq.ParquetFile(io.BytesIO(response.content))
+    assert parquet.metadata.num_rows == len(raw_data)
+    # The data covers a single UTC day
+    assert parquet.metadata.num_row_groups == 1
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_weather_get_percentiles(client: TestClient, auth_headers: dict[str, str]):
+    params: dict[str, Any] = {
+        "after": "2021-05-01T00:00:00+00:00",
+        "before": "2021-05-03T00:00:00+00:00",
+        "channel": ["relative_humidity_perc"],
+        "percentile": [50, 99.5],
+    }
+    response = client.get("/weather/percentiles", params=params, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["timestamp"] == ["2021-05-01T00:00:00+00:00"]
+    assert set(data) == {"timestamp", "count", "relative_humidity_perc"}
+    assert set(data["relative_humidity_perc"]) == {"50", "99.5"}
+    params["channel"] = ["foo"]
+    response = client.get("/weather/percentiles", params=params, headers=auth_headers)
+    assert response.status_code == 422
@@ -0,0 +1,81 @@
+import asyncio
+import importlib.util
+import pathlib
+
+import pytest
+
+from app.main import app
+
+_spec = importlib.util.spec_from_file_location("loadtest", "./scripts/loadtest.py")
+assert _spec is not None and _spec.loader is not None
+loadtest = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(loadtest)
+
+
+@pytest.fixture
+def cleanup():
+    yield
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.usefixtures("cleanup")
+def test_run_in_process(tmp_path: pathlib.Path):
+    async def run():
+        client = loadtest.in_process_client(
+            "./data/may/01", str(tmp_path / "db.sqlite")
+        )
+        async with client:
+            scenario = await loadtest.Scenario.create(client)
+            mix = loadtest.parse_mix(loadtest.DEFAULT_MIX)
+            return await loadtest.run(scenario, mix, concurrency=4, duration=0.5)
+
+    stats, elapsed = asyncio.run(run())
+    summary = loadtest.report(stats, elapsed)
+    assert set(summary) == {*loadtest.ENDPOINTS, "total"}
+    assert summary["total"]["requests"] == sum(
+        summary[endpoint]["requests"] for endpoint in loadtest.ENDPOINTS
+    )
+    assert summary["total"]["errors"] == 0
+    assert summary["total"]["p50_ms"] <= summary["total"]["p99_ms"]
+
+
+@pytest.mark.usefixtures("cleanup")
+def test_posts_are_new_and_deleted_afterwards(tmp_path: pathlib.Path):
+    db_path = str(tmp_path / "db.sqlite")
+
+    async def run():
+        client = loadtest.in_process_client("./data/may/01", db_path)
+        # Everything up to now is compacted, so posts must be later than that
+        loadtest.get_interactor(db_path).compact(0, 3600, 86400)
+        async with client:
+            scenario = await loadtest.Scenario.create(client)
+            mix = loadtest.parse_mix("post=1")
+            return await loadtest.run(scenario, mix, concurrency=2, duration=0.2)
+
+    stats, _ = asyncio.run(run())
+    posted = len(stats["post"].latencies)
+    assert posted > 0
+    assert stats["post"].errors == 0
+    assert loadtest.cleanup(db_path) == posted
+    assert loadtest.cleanup(db_path) == 0
+
+
+def test_percentile():
+    values = [float(i) for i in range(100)]
+    assert loadtest.percentile(values, 99) == 98
+    assert loadtest.percentile(values, 50) == 49
+    assert loadtest.percentile(values, 0) == 0
+    assert loadtest.percentile(values, 100) == 99
+    assert loadtest.percentile([float(i) for i in range(300)], 99) == 296
+    assert loadtest.percentile([1.0], 99) == 1
+
+
+def test_saturation():
+    steps = [
+        {"concurrency": c, "throughput": t}
+        for c, t in [(1, 100), (2, 190), (4, 200), (8, 230), (16, 225)]
+    ]
+    assert loadtest.saturation(steps)["concurrency"] == 8
+    assert loadtest.saturation(steps[:2]) is None
+    with pytest.raises(ValueError):
+        loadtest.parse_mix("latest=1,unknown=1")
@@ -0,0 +1,146 @@
+import pathlib
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from app.drivers import SQLiteConnection
+from app.migrations import SQLMigrator, _split_statements
+
+LEGACY_SCHEMA = """
+CREATE TABLE weather (
+    timestamp INT PRIMARY KEY,
+    external_temperature_c REAL NOT NULL,
+    wind_speed_unmuted_m_s REAL NOT NULL,
+    wind_speed_m_s REAL NOT NULL,
+    wind_direction_degrees REAL NOT NULL,
+    radiation_intensity_unmuted_w_m2 REAL NOT NULL,
+    radiation_intensity_w_m2 REAL NOT NULL,
+    standard_radiation_intensity_w_m2 REAL NOT NULL,
+    radiation_sum_j_cm2 REAL NOT NULL,
+    radiation_from_plant_w_m2 REAL NOT NULL,
+    precipitation REAL NOT NULL,
+    relative_humidity_perc REAL NOT NULL,
+    moisture_deficit_g_kg REAL NOT NULL,
+    moisture_deficit_g_m3 REAL NOT NULL,
+    dew_point_temperature_c REAL NOT NULL,
+    abs_humidity_g_kg REAL NOT NULL,
+    enthalpy_kj_kg REAL NOT NULL,
+    enthalpy_kj_m3 REAL NOT NULL,
+    atmospheric_pressure_hpa REAL NOT NULL
+);
+INSERT INTO weather VALUES (
+    1619856770, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18
+);
+"""
+
+
+def test_migrate_fresh_database(tmpdir: pathlib.Path):
+    conn = SQLiteConnection(tmpdir / "db.sqlite")
+    migrator = SQLMigrator(conn)
+    assert migrator.current_version() == 0
+    assert migrator.migrate() == migrator.latest_version
+    # Running it again is a no-op
+    assert migrator.migrate() == migrator.latest_version
+
+
+def test_migrate_legacy_database(tmpdir: pathlib.Path):
+    path = tmpdir / "db.sqlite"
+    legacy = sqlite3.connect(path)
+    legacy.executescript(LEGACY_SCHEMA)
+    legacy.close()
+
+    conn = SQLiteConnection(path)
+    SQLMigrator(conn).migrate()
+    conn.close()
+
+    conn2 = sqlite3.connect(path)
+    cur = conn2.cursor()
+    cur.execute("SELECT station_id, timestamp, atmospheric_pressure_hpa FROM weather")
+    assert cur.fetchall() == [("default", 1619856770, 18.0)]
+    # Clustered by (station, timestamp); no hidden rowid and primary key index
+    cur.execute("SELECT sql FROM sqlite_master WHERE name = 'weather'")
+    assert cur.fetchone()[0].endswith("WITHOUT ROWID")
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name")
+    assert cur.fetchall() == [
+        ("weather_compacted_timestamp",),
+        ("weather_sketch_day",),
+        ("weather_timestamp",),
+    ]
+    cur.execute("PRAGMA auto_vacuum")
+    assert cur.fetchone() == (2,)
+
+
+def test_split_statements():
+    script = """
+    -- A comment; with a semicolon
+    CREATE TABLE t (a TEXT DEFAULT 'x;y');
+    CREATE TRIGGER t_insert BEFORE INSERT ON t BEGIN
+        SELECT 1;
+        SELECT 2;
+    END;
+    -- Trailing comment
+    """
+    statements = _split_statements(script)
+    assert len(statements) == 3
+    assert statements[1].strip().startswith("CREATE TRIGGER")
+    assert statements[1].strip().endswith("END;")
+
+
+def _run_concurrently(path: pathlib.Path, n: int) -> tuple[list, list]:
+    barrier = threading.Barrier(n)
+    versions, errors = [], []
+
+    def migrate():
+        conn = SQLiteConnection(path)
+        barrier.wait()
+        try:
+            versions.append(SQLMigrator(conn).migrate())
+        except Exception as err:
+            errors.append(err)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=migrate) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return versions, errors
+
+
+def test_migrate_concurrently(tmpdir: pathlib.Path):
+    # E.g. multiple workers of the app, starting at the same time
+    path = tmpdir / "db.sqlite"
+    versions, errors = _run_concurrently(path, 4)
+    assert errors == []
+    latest = SQLMigrator(SQLiteConnection(path)).latest_version
+    assert versions == [latest] * 4
+
+
+def _slow_script(seconds: float) -> str:
+    """A migration that takes about `seconds` on this machine"""
+    query = (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+        "WHERE i < {}) SELECT count(*) FROM n"
+    )
+    conn = sqlite3.connect(":memory:")
+    start = time.perf_counter()
+    conn.execute(query.format(10**6)).fetchall()
+    count = int(10**6 * seconds / (time.perf_counter() - start))
+    return f"CREATE TABLE slow AS {query.format(count)};"
+
+
+def test_migrate_concurrently_with_a_slow_migration(
+    tmpdir: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+):
+    # Takes longer than SQLite's default busy timeout of 5 seconds; the slow
+    # migration fails if it runs twice, since its table already exists
+    migrations = SQLMigrator._migrations
+    slow = (migrations[-1][0] + 1, _slow_script(6))
+    monkeypatch.setattr(SQLMigrator, "_migrations", [*migrations, slow])
+    path = tmpdir / "db.sqlite"
+    versions, errors = _run_concurrently(path, 2)
+    assert errors == []
+    assert versions == [slow[0]] * 2
@@ -0,0 +1,71 @@
+import json
+import pathlib
+import pstats
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.middleware import ProfilingMiddleware
+from app.profiling import Profile, ProfileStore, phase
+
+
+def _client(store: ProfileStore) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/")
+    def endpoint():
+        # Sync endpoints run in a thread pool
+        with phase("sql"):
+            time.sleep(0.01)
+            with phase("row_to_weather"):
+                time.sleep(0.01)
+        return {}
+
+    app.add_middleware(
+        ProfilingMiddleware, store=store, authorize=lambda token: token == "write"
+    )
+    return TestClient(app)
+
+
+def test_profiled_request(tmp_path: pathlib.Path):
+    client = _client(ProfileStore(str(tmp_path)))
+    response = client.get(
+        "/", headers={"X-Profile": "1", "Authorization": "Bearer write"}
+    )
+    assert response.status_code == 200
+    profile_id = response.headers["X-Profile-Id"]
+    with open(tmp_path / f"{profile_id}.json") as f:
+        summary = json.load(f)
+    phases = summary["phases"]
+    assert set(phases) == {"sql", "row_to_weather"}
+    # Nested phases are excluded from their parent
+    assert 0.01 <= phases["sql"]["seconds"] < 0.02
+    assert phases["row_to_weather"]["seconds"] >= 0.01
+    assert summary["total_seconds"] >= 0.02
+    stats = pstats.Stats(str(tmp_path / f"{profile_id}.pstats"))
+    assert any("time.sleep" in func[2] for func in stats.stats)  # type: ignore
+
+
+def test_not_profiled_without_write_access(tmp_path: pathlib.Path):
+    client = _client(ProfileStore(str(tmp_path)))
+    response = client.get(
+        "/", headers={"X-Profile": "1", "Authorization": "Bearer read"}
+    )
+    assert "X-Profile-Id" not in response.headers
+    response = client.get("/", headers={"Authorization": "Bearer write"})
+    assert "X-Profile-Id" not in response.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_store_keeps_most_recent(tmp_path: pathlib.Path):
+    store = ProfileStore(str(tmp_path), retention=2)
+    profiles = [Profile() for _ in range(3)]
+    for profile in profiles:
+        with profile.activate(), phase("sql"):
+            pass
+        store.save(profile)
+    assert store.path(profiles[0].id, "json") is None
+    assert store.path(profiles[2].id, "json") is not None
+    assert store.path(profiles[2].id, "pstats") is not None
+    assert store.path("../db", "json") is None
@@ -0,0 +1,39 @@
+from app.resampling import aligned_grid, fill_grid, minmax
+
+
+def test_minmax_keeps_peaks():
+    ys = [0.0] * 1000
+    ys[417] = 10.0
+    ys[803] = -5.0
+    samples = ((float(x), (y, -y)) for x, y in enumerate(ys))
+    points = minmax(samples, 0.0, 1000.0, 10)
+    assert len(points) == 2
+    assert (417.0, 10.0) in points[0]
+    assert (803.0, -5.0) in points[0]
+    assert (417.0, -10.0) in points[1]
+    assert (803.0, 5.0) in points[1]
+    for column in points:
+        assert len(column) <= 20
+        assert column == sorted(column)
+
+
+def test_minmax_single_sample_per_bucket():
+    samples = [(0.0, (1.0,)), (5.0, (3.0,)), (9.0, (2.0,))]
+    assert minmax(iter(samples), 0.0, 10.0, 10) == [
+        [(0.0, 1.0), (5.0, 3.0), (9.0, 2.0)]
+    ]
+    assert minmax(iter([]), 0.0, 10.0, 10) == []
+
+
+def test_aligned_grid():
+    # Daily buckets at UTC+2 start at 22:00 UTC
+    assert list(aligned_grid(0, 2 * 86400, 86400, 7200)) == [79200, 165600]
+
+
+def test_fill_grid():
+    xs = [0, 20, 30]
+    columns = {"a": [0.0, 2.0, 3.0]}
+    grid = [0, 10, 20, 30, 40]
+    assert fill_grid(xs, columns, grid, "null") == {"a": [0.0, None, 2.0, 3.0, None]}
+    assert fill_grid(xs, columns, grid, "ffill") == {"a": [0.0, 0.0, 2.0, 3.0, 3.0]}
+    assert fill_grid(xs, columns, grid, "linear") == {"a": [0.0, 1.0, 2.0, 3.0, None]}
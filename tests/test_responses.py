@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.responses import WeatherJSONResponse
+
+TZ = timezone(timedelta(seconds=3661))
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        {"timestamp": [datetime(2021, 5, 1, tzinfo=TZ)], "value": [1.5, None, -0.0]},
+        {"small": [1e-05, 2.5e-05, 1.5e-07, 0.0001], "large": [1e16, 1.7e308]},
+        {"station_id": ["kas-é ", None], "precipitation": 0.30000000000000004},
+        {"timestamp": datetime(2021, 5, 1, 8, 2, 50, 123000), "value": 12},
+        {"station_id": ['1e5 "0.00001\\', "-2E3"], "value": [1e-7, 10.00001, -1e17]},
+        {"nested": [{"value": [-0.00005, 5e-324]}, {"1e16": 1e16}]},
+    ],
+)
+def test_renders_like_fastapi(content: dict):
+    expected = JSONResponse(jsonable_encoder(content)).body
+    assert WeatherJSONResponse(content).body == expected
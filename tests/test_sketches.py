@@ -0,0 +1,51 @@
+import bisect
+import math
+import random
+
+import pytest
+
+from app.sketches import TDigest
+
+
+def rank_error(values: list[float], q: float, estimate: float) -> float:
+    """Distance between q and the range of ranks `estimate` has in `values`"""
+    ordered = sorted(values)
+    low = bisect.bisect_left(ordered, estimate) / len(ordered)
+    high = bisect.bisect_right(ordered, estimate) / len(ordered)
+    return 0.0 if low <= q <= high else min(abs(low - q), abs(high - q))
+
+
+def bound(q: float, compression: float) -> float:
+    return 2 * math.pi * math.sqrt(q * (1 - q)) / compression
+
+
+@pytest.mark.parametrize(
+    "sample",
+    [
+        lambda rng: rng.gauss(15, 5),
+        lambda rng: rng.lognormvariate(0, 2),
+        lambda rng: rng.choice([0.0, 0.0, 0.0, 0.2, 1.5]),
+    ],
+)
+def test_merged_daily_digests_within_bound(sample):
+    rng = random.Random(42)
+    merged = TDigest()
+    values = []
+    for _ in range(60):
+        day = [sample(rng) for _ in range(288)]
+        digest = TDigest()
+        digest.add(day)
+        merged.merge(TDigest.from_bytes(digest.to_bytes()))
+        values.extend(day)
+    assert merged.count == len(values)
+    for q in (0.0, 0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99, 1.0):
+        estimate = merged.quantile(q)
+        assert estimate is not None
+        assert rank_error(values, q, estimate) <= bound(q, merged.compression)
+    assert merged.quantile(0) == min(values)
+    assert merged.quantile(1) == max(values)
+
+
+def test_empty_digest():
+    assert TDigest().quantile(0.5) is None
+    assert TDigest.from_bytes(TDigest().to_bytes()).quantile(0.5) is None
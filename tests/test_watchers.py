@@ -0,0 +1,77 @@
+import os
+import pathlib
+
+from app.watchers import DirectoryWatcher
+
+
+def _touch(path: pathlib.Path, mtime: int) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("{}")
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_new_files_are_returned_once_committed(tmp_path: pathlib.Path):
+    root = tmp_path / "data"
+    state = tmp_path / "state.json"
+    _touch(root / "01" / "meteo-0002.json", 1_000)
+    _touch(root / "01" / "meteo-0007.json", 2_000)
+    watcher = DirectoryWatcher(str(root), str(state), settle_seconds=0)
+    paths = watcher.poll()
+    assert [os.path.basename(p) for p in paths] == [
+        "meteo-0002.json",
+        "meteo-0007.json",
+    ]
+    # Not committed yet, so still new
+    assert watcher.poll() == paths
+    watcher.commit(paths)
+    assert watcher.poll() == []
+    watcher.close()
+
+
+def test_restart_continues_from_state(tmp_path: pathlib.Path):
+    root = tmp_path / "data"
+    state = tmp_path / "state.json"
+    _touch(root / "01" / "meteo-0002.json", 1_000)
+    watcher = DirectoryWatcher(str(root), str(state), settle_seconds=0)
+    watcher.commit(watcher.poll())
+    watcher.close()
+
+    # New file at the same mtime as a committed one, and one in a new directory
+    _touch(root / "01" / "meteo-0007.json", 1_000)
+    _touch(root / "02" / "meteo-0002.json", 3_000)
+    watcher = DirectoryWatcher(str(root), str(state), settle_seconds=0)
+    assert [os.path.relpath(p, root) for p in watcher.poll()] == [
+        os.path.join("01", "meteo-0007.json"),
+        os.path.join("02", "meteo-0002.json"),
+    ]
+    watcher.close()
+
+
+def test_unsettled_files_are_held_back(tmp_path: pathlib.Path):
+    root = tmp_path / "data"
+    (root / "meteo-0002.json").parent.mkdir()
+    (root / "meteo-0002.json").write_text("{}")
+    watcher = DirectoryWatcher(str(root), str(tmp_path / "state.json"))
+    assert watcher.poll() == []
+    watcher.close()
+
+
+def test_files_moved_in_with_an_old_mtime_are_new(tmp_path: pathlib.Path):
+    root = tmp_path / "data"
+    state = tmp_path / "state.json"
+    _touch(root / "01" / "meteo-0007.json", 2_000)
+    watcher = DirectoryWatcher(str(root), str(state), settle_seconds=0)
+    watcher.commit(watcher.poll())
+    watcher.close()
+
+    # As with `mv` or `rsync -t`, which keep the modification time
+    _touch(tmp_path / "incoming" / "meteo-0002.json", 1_000)
+    os.rename(
+        tmp_path / "incoming" / "meteo-0002.json", root / "01" / "meteo-0002.json"
+    )
+    watcher = DirectoryWatcher(str(root), str(state), settle_seconds=0)
+    paths = watcher.poll()
+    assert [os.path.basename(p) for p in paths] == ["meteo-0002.json"]
+    watcher.commit(paths)
+    assert watcher.poll() == []
+    watcher.close()
@@ -1,15 +1,23 @@
+import bisect
+import math
 import pathlib
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import pytest
 from pydantic import ValidationError
 
+from app.adapters import CliWeatherAdapter
+from app.drivers import SQLiteConnection
 from app.entities import WeatherData
-from app.exceptions import DatabaseIntegrityError
+from app.exceptions import DatabaseIntegrityError, DataNotFoundError
+from app.gateways import SQLWeatherDbGateway
 from app.interactors import (
     AverageWeatherQuery,
     LatestWeatherQuery,
+    PercentileWeatherQuery,
+    RetentionPolicy,
+    RollingWeatherQuery,
     TimeSeriesWeatherQuery,
     WeatherInteractor,
 )
@@ -26,6 +34,31 @@ def test_query_validators():
         )
 
 
+@pytest.mark.parametrize(
+    "interval, days",
+    [
+        (timedelta(0), 1),
+        (timedelta(seconds=0.5), 1),
+        (timedelta(seconds=-60), 1),
+        # Over MAX_BUCKETS
+        (timedelta(seconds=1), 365),
+    ],
+)
+def test_timeseries_query_interval(interval: timedelta, days: int):
+    after = datetime.fromisoformat("2021-05-01T00:00:00+02:00")
+    with pytest.raises(ValidationError):
+        TimeSeriesWeatherQuery(
+            after=after, before=after + timedelta(days=days), interval=interval
+        )
+    with pytest.raises(ValidationError):
+        RollingWeatherQuery(
+            after=after,
+            before=after + timedelta(days=days),
+            window=timedelta(hours=1),
+            step=interval,
+        )
+
+
 @pytest.mark.usefixtures("prepopulated_db")
 def test_load(db_path: pathlib.Path, data: list):
     conn = sqlite3.connect(db_path)
@@ -42,6 +75,15 @@ def test_duplicate_entry_raises_error(
         interactor.load(data[:1])
 
 
+def test_load_batch_skips_files_that_cant_be_read(
+    interactor: WeatherInteractor, tmp_path: pathlib.Path
+):
+    adapter = CliWeatherAdapter(interactor)
+    paths = ["./data/may/01/meteo-0002.json", str(tmp_path / "removed.json")]
+    assert adapter.load_batch(paths) == 1
+    assert adapter.load_batch(paths) == 0
+
+
 @pytest.mark.usefixtures("prepopulated_db")
 def test_get_latest(interactor: WeatherInteractor, data: list[WeatherData]):
     data.sort()
@@ -69,3 +111,252 @@ def test_get_timeseries(interactor: WeatherInteractor):
     result = interactor.get(query)
     assert len(result) == 24
     assert result[-1].wind_direction_degrees == 317.0833333333333
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+@pytest.mark.parametrize("interval", [timedelta(minutes=5), timedelta(hours=1)])
+@pytest.mark.parametrize("offset", [timedelta(0), TZ, timedelta(minutes=-30)])
+def test_get_timeseries_in_parallel(
+    interactor: WeatherInteractor,
+    db_path: pathlib.Path,
+    interval: timedelta,
+    offset: timedelta,
+):
+    query = TimeSeriesWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T02:17:00+02:00"),
+        before=datetime.fromisoformat("2021-05-02T01:43:00+02:00"),
+        interval=interval,
+        tz_offset=offset,
+    )
+    gateway = SQLWeatherDbGateway(
+        SQLiteConnection(db_path),
+        connect=lambda: SQLiteConnection(db_path),
+        parallelism=3,
+        split_threshold=timedelta(0),
+    )
+    ranges = gateway._split_between(
+        query.after, query.before, interval, timezone(offset)
+    )
+    assert len(ranges) == 3
+    assert WeatherInteractor(gateway).get(query) == interactor.get(query)
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_get_rolling(interactor: WeatherInteractor, data: list[WeatherData]):
+    query = RollingWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T14:00:00+02:00"),
+        before=datetime.fromisoformat("2021-05-02T02:00:00+02:00"),
+        window=timedelta(hours=3),
+        step=timedelta(hours=1),
+        tz_offset=TZ,
+    )
+    result = interactor.get(query)
+    assert len(result) == 12
+    # Compare against brute force over the raw data
+    for entry in result:
+        window = [
+            d.external_temperature_c
+            for d in data
+            if entry.timestamp - timedelta(hours=3) < d.timestamp <= entry.timestamp
+        ]
+        assert entry.external_temperature_c == pytest.approx(sum(window) / len(window))
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_apply_retention(interactor: WeatherInteractor, db_path: pathlib.Path):
+    timeseries = TimeSeriesWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T02:00:00+02:00"),
+        before=datetime.fromisoformat("2021-05-02T02:00:00+02:00"),
+        interval=timedelta(hours=1),
+        tz_offset=TZ,
+    )
+    average = AverageWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T00:00:00+02:00"), tz_offset=TZ
+    )
+    expected_timeseries = interactor.get(timeseries)
+    expected_average = interactor.get(average)
+
+    policy = RetentionPolicy(max_age=timedelta(hours=12), batch=timedelta(hours=5))
+    now = datetime.fromisoformat("2021-05-02T02:00:00+02:00")
+    removed = interactor.apply_retention(policy, now=now)
+    assert removed == 144
+    # Running it twice doesn't change anything
+    assert interactor.apply_retention(policy, now=now) == 0
+
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT count(*), sum(samples) FROM weather_compacted")
+    assert cur.fetchone() == (12, 144)
+
+    result = interactor.get(timeseries)
+    assert len(result) == len(expected_timeseries)
+    for entry, expected in zip(result, expected_timeseries, strict=True):
+        assert entry.timestamp == expected.timestamp
+        assert entry.external_temperature_c == pytest.approx(
+            expected.external_temperature_c
+        )
+    assert interactor.get(average)[0].relative_humidity_perc == pytest.approx(
+        expected_average[0].relative_humidity_perc
+    )
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_read_and_write_after_compacting_everything(
+    interactor: WeatherInteractor, data: list[WeatherData]
+):
+    policy = RetentionPolicy(max_age=timedelta(hours=12))
+    now = datetime.fromisoformat("2021-05-03T00:00:00+02:00")
+    assert interactor.apply_retention(policy, now=now) == len(data)
+    latest = interactor.get(LatestWeatherQuery(tz_offset=TZ))
+    last = max(d.timestamp for d in data)
+    assert latest[0].timestamp == last.replace(minute=0, second=0)
+
+    # Buckets that `after` falls in are included
+    after = datetime.fromisoformat("2021-05-01T12:30:00+02:00")
+    average = interactor.get(AverageWeatherQuery(after=after, tz_offset=TZ))
+    bucket_start = datetime.fromisoformat("2021-05-01T12:00:00+02:00")
+    expected = [d.external_temperature_c for d in data if d.timestamp >= bucket_start]
+    assert average[0].timestamp == after
+    assert average[0].external_temperature_c == pytest.approx(
+        sum(expected) / len(expected)
+    )
+
+    # Re-posted data can't be told apart from new data anymore, so is refused;
+    # newer data is still accepted
+    with pytest.raises(DatabaseIntegrityError):
+        interactor.load(data[:1])
+    interactor.load(
+        [
+            d.copy(update={"timestamp": d.timestamp + timedelta(days=2)})
+            for d in data[:1]
+        ]
+    )
+
+    # Buckets of another size would overlap the existing ones
+    with pytest.raises(ValueError):
+        interactor.apply_retention(
+            policy.copy(update={"interval": timedelta(hours=2)}),
+            now=now + timedelta(days=3),
+        )
+    assert interactor.apply_retention(policy, now=now + timedelta(days=3)) == 1
+
+
+def test_rename_station(interactor: WeatherInteractor, data: list[WeatherData]):
+    # E.g. history from before stations were stored, and newer data
+    half = len(data) // 2
+    interactor.load([d.copy(update={"station_id": "default"}) for d in data[:half]])
+    interactor.load(data[half:])
+    assert interactor.rename_station("default", "_ws_source_meteo") == half
+    query = TimeSeriesWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T00:00:00+02:00"),
+        before=datetime.fromisoformat("2021-05-02T02:00:00+02:00"),
+        interval=timedelta(days=2),
+        station_id="_ws_source_meteo",
+    )
+    expected = sum(d.external_temperature_c for d in data) / len(data)
+    result = interactor.get(query)
+    assert result[0].external_temperature_c == pytest.approx(expected)
+    percentiles = interactor.get_percentiles(
+        PercentileWeatherQuery(
+            after=query.after,
+            before=query.before,
+            period="total",
+            station_id="_ws_source_meteo",
+        )
+    )
+    assert percentiles[0].count == len(data)
+    # Nothing is left behind under the old id
+    assert interactor.get(query.copy(update={"station_id": "default"})) == []
+
+
+def test_delete_station(interactor: WeatherInteractor, data: list[WeatherData]):
+    interactor.load(data)
+    interactor.load([d.copy(update={"station_id": "loadtest"}) for d in data])
+    assert interactor.delete_station("loadtest") == len(data)
+    assert interactor.delete_station("loadtest") == 0
+    query = LatestWeatherQuery(station_id="loadtest")
+    with pytest.raises(DataNotFoundError):
+        interactor.get(query)
+    latest = interactor.get(query.copy(update={"station_id": None}))[0]
+    assert latest.station_id == data[0].station_id
+
+
+def test_multiple_stations(interactor: WeatherInteractor, data: list[WeatherData]):
+    other = [d.copy(update={"station_id": "other"}) for d in data]
+    for d in other:
+        d.external_temperature_c += 10
+    interactor.load(data)
+    interactor.load(other)
+    query = TimeSeriesWeatherQuery(
+        after=datetime.fromisoformat("2021-05-01T02:00:00+02:00"),
+        before=datetime.fromisoformat("2021-05-02T02:00:00+02:00"),
+        interval=timedelta(hours=1),
+        tz_offset=TZ,
+    )
+    own = interactor.get(query.copy(update={"station_id": "_ws_source_meteo"}))
+    others = interactor.get(query.copy(update={"station_id": "other"}))
+    combined = interactor.get(query)
+    assert len(own) == len(others) == len(combined) == 24
+    assert own[0].station_id == "_ws_source_meteo"
+    assert combined[0].station_id is None
+    for a, b, c in zip(own, others, combined, strict=True):
+        assert b.external_temperature_c == pytest.approx(a.external_temperature_c + 10)
+        assert c.external_temperature_c == pytest.approx(a.external_temperature_c + 5)
+    latest = interactor.get(LatestWeatherQuery(station_id="other", tz_offset=TZ))
+    assert latest[0].station_id == "other"
+
+
+def test_get_percentiles(interactor: WeatherInteractor, data: list[WeatherData]):
+    # Loaded in two parts, so the sketches of a day get merged on load
+    interactor.load(data[: len(data) // 2])
+    interactor.load(data[len(data) // 2 :])
+    query = PercentileWeatherQuery(
+        after=datetime(2021, 4, 1, tzinfo=timezone.utc),
+        before=datetime(2021, 6, 1, tzinfo=timezone.utc),
+        percentiles=[5, 50, 95],
+        period="total",
+    )
+    result = interactor.get_percentiles(query)
+    # Rebuilding from raw data merges in a different order, so estimates
+    # differ slightly, but should be as accurate
+    assert interactor.rebuild_sketches() == len(data)
+    rebuilt = interactor.get_percentiles(query)
+    for entry in [*result, *rebuilt]:
+        assert entry.count == len(data)
+        values = sorted(getattr(d, entry.channel) for d in data)
+        for p, estimate in zip(query.percentiles, entry.values, strict=True):
+            q = p / 100
+            low = bisect.bisect_left(values, estimate) / len(values)
+            high = bisect.bisect_right(values, estimate) / len(values)
+            # Documented bound on the rank error
+            bound = 2 * math.pi * math.sqrt(q * (1 - q)) / 100
+            assert low - bound <= q <= high + bound
+    assert {r.channel for r in result} == set(query.channels)
+
+    daily = interactor.get_percentiles(query.copy(update={"period": "day"}))
+    temperature = [r for r in daily if r.channel == "external_temperature_c"]
+    assert sum(r.count for r in temperature) == len(data)
+
+
+@pytest.mark.usefixtures("prepopulated_db")
+def test_rebuild_sketches_keeps_compacted_days(
+    interactor: WeatherInteractor, data: list[WeatherData]
+):
+    # The data covers one UTC day; add the next, then compact the first
+    raw = [d.copy(update={"timestamp": d.timestamp + timedelta(days=1)}) for d in data]
+    interactor.load(raw)
+    midnight = datetime(2021, 5, 2, tzinfo=timezone.utc)
+    policy = RetentionPolicy(max_age=timedelta(hours=12))
+    compacted = interactor.apply_retention(policy, now=midnight + policy.max_age)
+    assert compacted == len(data)
+
+    assert interactor.rebuild_sketches() == len(raw)
+    query = PercentileWeatherQuery(
+        after=midnight - timedelta(days=1),
+        before=midnight + timedelta(days=1),
+        percentiles=[50],
+        channels=["external_temperature_c"],
+        period="day",
+    )
+    counts = {r.timestamp: r.count for r in interactor.get_percentiles(query)}
+    assert counts == {midnight - timedelta(days=1): len(data), midnight: len(raw)}